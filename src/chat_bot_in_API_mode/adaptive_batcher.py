@@ -0,0 +1,48 @@
+from src.chat_bot_in_API_mode import config
+from src.chat_bot_in_API_mode.rate_limiter import estimate_tokens
+
+class AdaptiveBatcher:
+    """
+    Decides how many chunks go into one embedding request.
+    The batch doubles while requests succeed quickly, then grows by one once a
+    quota error has been seen; quota errors and slow requests halve it.
+    Every batch is also capped so its estimated tokens fit in the TPM budget.
+    """
+    def __init__(self, max_batch=config.EMBED_MAX_BATCH, start_batch=config.EMBED_START_BATCH,
+                 target_latency=config.EMBED_TARGET_LATENCY, token_budget=config.TPM_LIMIT):
+        self.max_batch = max_batch
+        self.batch_size = max(1, min(start_batch, max_batch))
+        self.target_latency = target_latency
+        self.token_budget = token_budget
+        self._slow_start = True
+
+    def fit(self, candidates):
+        """Takes the longest prefix of `candidates` that fits the current size and token budget.
+        Returns (batch, estimated_tokens). Always returns at least one chunk."""
+        batch = []
+        tokens = 0
+        for chunk in candidates[:self.batch_size]:
+            cost = estimate_tokens(chunk.page_content)
+            if batch and tokens + cost > self.token_budget:
+                break
+            batch.append(chunk)
+            tokens += cost
+        return batch, tokens
+
+    def on_success(self, latency):
+        if latency > self.target_latency:
+            self._shrink()
+        elif self._slow_start:
+            self.batch_size = min(self.max_batch, self.batch_size * 2)
+        else:
+            self.batch_size = min(self.max_batch, self.batch_size + 1)
+
+    def on_quota_error(self):
+        self._slow_start = False
+        self._shrink()
+
+    def _shrink(self):
+        old_size = self.batch_size
+        self.batch_size = max(1, self.batch_size // 2)
+        if self.batch_size != old_size:
+            print(f"📉 Batch size: {old_size} -> {self.batch_size}")
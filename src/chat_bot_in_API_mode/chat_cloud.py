@@ -2,17 +2,18 @@ from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_openai import ChatOpenAI
 from langchain_anthropic import ChatAnthropic
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
-from src import config
-from src.vector_store import vector_store
-from src.prompts import RAG_PROMPT
-from src.key_manager import key_manager
+from langchain_core.runnables import RunnablePassthrough, RunnableLambda
+from src.chat_bot_in_API_mode import config
+from src.chat_bot_in_API_mode.vector_store import vector_store
+from src.chat_bot_in_API_mode.prompts import RAG_PROMPT
+from src.chat_bot_in_API_mode.key_manager import key_manager
+from src.chat_bot_in_API_mode.rate_limiter import limit_rate, estimate_tokens
 
 class ChatCloud:
     def __init__(self, provider="gemini"):
         self.provider = provider.lower()
         self.llm = self._init_llm()
-        self.retriever = vector_store.db.as_retriever(search_kwargs={"k": 5})
+        self.retriever = vector_store.as_retriever(k=5)
 
     def _init_llm(self):
         if self.provider == "gemini":
@@ -38,8 +39,15 @@ class ChatCloud:
         Executes the RAG chain: Retrieve -> Augmented Prompt -> LLM -> Answer
         """
         # Re-init Gemini key in case it rotated during retrieval (though less likely for Generation)
+        llm = self.llm
         if self.provider == "gemini":
-             self.llm.google_api_key = key_manager.get_current_key()
+             key = key_manager.get_current_key()
+             self.llm.google_api_key = key
+             # Same key quota as embeddings: reserve the prompt estimate, then reconcile
+             # with the prompt + answer tokens Gemini reports in usage_metadata
+             llm = RunnableLambda(limit_rate(
+                 count_tokens=lambda prompt: estimate_tokens(prompt.to_string()), api_key=key
+             )(self.llm.invoke))
 
         def format_docs(docs):
             return "\n\n".join(doc.page_content for doc in docs)
@@ -47,7 +55,7 @@ class ChatCloud:
         rag_chain = (
             {"context": self.retriever | format_docs, "question": RunnablePassthrough()}
             | RAG_PROMPT
-            | self.llm
+            | llm
             | StrOutputParser()
         )
 
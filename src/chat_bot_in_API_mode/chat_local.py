@@ -1,9 +1,9 @@
 from langchain_ollama import ChatOllama
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.runnables import RunnablePassthrough
-from src import config
-from src.vector_store import vector_store
-from src.prompts import RAG_PROMPT
+from src.chat_bot_in_API_mode import config
+from src.chat_bot_in_API_mode.vector_store import vector_store
+from src.chat_bot_in_API_mode.prompts import RAG_PROMPT
 
 class ChatLocal:
     def __init__(self):
@@ -11,7 +11,7 @@ class ChatLocal:
             base_url=config.OLLAMA_BASE_URL,
             model=config.OLLAMA_MODEL
         )
-        self.retriever = vector_store.db.as_retriever(search_kwargs={"k": 5})
+        self.retriever = vector_store.as_retriever(k=5)
 
     def chat(self, question):
         """
@@ -7,6 +7,8 @@ load_dotenv()
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 DATA_DIR = os.path.join(BASE_DIR, "data")
 DB_DIR = os.path.join(BASE_DIR, "db")
+INGEST_JOURNAL_PATH = os.path.join(DB_DIR, "ingest_journal.jsonl")  # Committed chunk IDs, for resuming
+LEXICAL_INDEX_DIR = os.path.join(DB_DIR, "bm25")  # BM25 index over the stored chunks (hybrid retrieval)
 
 # Chunking Settings
 CHUNK_SIZE = 1000
@@ -16,7 +18,22 @@ CHUNK_OVERLAP = 200
 # Adjust based on your specific tier limits
 RPM_LIMIT = 5          # Requests Per Minute
 TPM_LIMIT = 10000     # Tokens Per Minute
-SLEEP_INTERVAL = 1.0    # Seconds to check/sleep
+
+# Batched Embedding (ingest)
+EMBED_MAX_BATCH = 100          # batchEmbedContents accepts at most 100 texts per request
+EMBED_START_BATCH = 8          # Initial batch size before adapting
+EMBED_TARGET_LATENCY = 10.0    # Seconds; batches slower than this shrink
+WORKER_MAX_FAILURES = 5        # Consecutive quota errors before a parallel worker gives up its key
+
+# Shared quota ledger (coordinates keys/limits across all processes on this host)
+QUOTA_LEDGER_ENABLED = os.getenv("QUOTA_LEDGER_ENABLED", "1") != "0"
+QUOTA_LEDGER_PATH = os.getenv("QUOTA_LEDGER_PATH", os.path.join(BASE_DIR, "quota_ledger.sqlite3"))
+KEY_COOLDOWN_SECONDS = 60      # Base cooldown for a key that returned 429 without a retry hint (doubles on repeats)
+KEY_DAILY_COOLDOWN_SECONDS = 3600  # Cooldown for a key whose daily quota is used up
+
+# Embedding cache (text already embedded once never costs quota again)
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", os.path.join(BASE_DIR, "embedding_cache.sqlite3"))
+EMBED_CACHE_MAX_ENTRIES = 200000   # Least recently used vectors are evicted beyond this
 
 # API Keys
 # Expects a comma-separated list of keys
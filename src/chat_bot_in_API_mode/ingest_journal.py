@@ -0,0 +1,36 @@
+import json
+import os
+import time
+from src.chat_bot_in_API_mode import config
+
+class IngestJournal:
+    """
+    Append-only log of chunk IDs that are safely stored in Chroma.
+    One JSON line per committed batch, flushed to disk before the next batch starts,
+    so an interrupted ingest knows exactly which chunks it can skip.
+    """
+    def __init__(self, path=config.INGEST_JOURNAL_PATH):
+        self.path = path
+
+    def committed_ids(self):
+        ids = set()
+        if not os.path.exists(self.path):
+            return ids
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    ids.update(json.loads(line)["ids"])
+                except (ValueError, KeyError):
+                    continue  # half-written last line from a crash
+        return ids
+
+    def record(self, ids):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"ts": time.time(), "ids": list(ids)}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def reset(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
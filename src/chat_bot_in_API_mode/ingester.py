@@ -1,7 +1,8 @@
 import os
+import hashlib
 from langchain_community.document_loaders import PyPDFLoader, TextLoader, DirectoryLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from src import config
+from src.chat_bot_in_API_mode import config
 
 class Ingester:
     def __init__(self):
@@ -35,10 +36,19 @@ class Ingester:
         text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=self.chunk_size,
             chunk_overlap=self.chunk_overlap,
-            separators=["\n\n", "\n", " ", ""]
+            separators=["\n\n", "\n", " ", ""],
+            add_start_index=True  # chunk offset, needed by chunk_id
         )
         chunks = text_splitter.split_documents(documents)
         print(f"Split {len(documents)} docs into {len(chunks)} chunks.")
         return chunks
 
+    @staticmethod
+    def chunk_id(chunk):
+        """Deterministic ID from source path, chunk offset and content hash.
+        Re-ingesting the same chunk gives the same ID, so Chroma upserts instead of duplicating."""
+        content_hash = hashlib.sha256(chunk.page_content.encode("utf-8")).hexdigest()
+        key = f"{chunk.metadata.get('source', '')}|{chunk.metadata.get('page', '')}|{chunk.metadata.get('start_index', '')}|{content_hash}"
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+
 ingester = Ingester()
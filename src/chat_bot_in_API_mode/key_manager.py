@@ -1,28 +1,133 @@
 import itertools
+import re
+import threading
 import time
+import google.api_core.exceptions
 from src.chat_bot_in_API_mode import config
+from src.chat_bot_in_API_mode.quota_ledger import quota_ledger
+
+# Hints Google puts in 429 messages: "retry_delay { seconds: 37 }", "Please retry in 37.5s"
+_RETRY_HINT_PATTERNS = [
+    re.compile(r"retry_delay\s*\{\s*seconds:\s*(\d+)"),
+    re.compile(r"retry in\s*([\d.]+)\s*s", re.IGNORECASE),
+    re.compile(r"retry-after:?\s*([\d.]+)", re.IGNORECASE),
+]
+
+def is_quota_error(error):
+    """True if an API call failed because of a quota / rate limit (HTTP 429)."""
+    if isinstance(error, google.api_core.exceptions.ResourceExhausted):
+        return True
+    return "429" in str(error) or "ResourceExhausted" in str(error)
+
+def retry_after(error):
+    """Seconds the API asked us to wait, or None if the error carries no hint."""
+    message = str(error)
+    for pattern in _RETRY_HINT_PATTERNS:
+        match = pattern.search(message)
+        if match:
+            return float(match.group(1))
+    return None
+
+class KeyHealth:
+    """What we currently know about one API key."""
+    def __init__(self):
+        self.cooldown_until = 0.0
+        self.error_rate = 0.0        # moving average of quota errors per call (0 = never fails)
+        self.consecutive_errors = 0
+        self.exhausted = False       # daily quota used up: skip until the cooldown ends
+
+    def record(self, failed):
+        self.error_rate = 0.8 * self.error_rate + (0.2 if failed else 0.0)
+        self.consecutive_errors = self.consecutive_errors + 1 if failed else 0
 
 class KeyManager:
     def __init__(self):
         self.keys = config.GOOGLE_API_KEYS
         if not self.keys:
             raise ValueError("No API keys available.")
-        
+
         self._key_cycle = itertools.cycle(self.keys)
         self.current_key = next(self._key_cycle)
         self.key_usage = {k: 0 for k in self.keys}
+        self.health = {k: KeyHealth() for k in self.keys}
+        self._lock = threading.Lock()
 
     def get_current_key(self):
         return self.current_key
 
+    def available_in(self, key):
+        """Seconds until `key` may be used again (0 = now), from our view and the shared ledger."""
+        wait = self.health[key].cooldown_until - time.time()
+        if quota_ledger is not None:
+            wait = max(wait, quota_ledger.cooldown_remaining(key))
+        return max(0.0, wait)
+
+    def _remaining_quota(self, key):
+        """Fraction (0..1) of this minute's RPM/TPM still free for `key` across all processes."""
+        if quota_ledger is None:
+            return 1.0
+        requests, tokens = quota_ledger.usage(key)
+        return max(0.0, min(1 - requests / config.RPM_LIMIT, 1 - tokens / config.TPM_LIMIT))
+
+    def acquire_key(self):
+        """
+        Picks the key most likely to succeed right now and makes it the current key.
+        Returns (key, wait): wait is 0 unless every key is cooling down, in which case
+        it is the exact time until the earliest one comes back.
+        """
+        with self._lock:
+            waits = {k: self.available_in(k) for k in self.keys}
+            ready = [k for k in self.keys if waits[k] <= 0]
+            if ready:
+                # Prefer free quota and a clean error history; stay on the current key on ties
+                key = max(ready, key=lambda k: (self._remaining_quota(k) * (1 - self.health[k].error_rate),
+                                                k == self.current_key))
+                wait = 0.0
+            else:
+                key = min(self.keys, key=lambda k: waits[k])
+                wait = waits[key]
+            if key != self.current_key:
+                print(f"🔑 Using API Key ...{key[-4:]}")
+            self.current_key = key
+            return key, wait
+
+    def report_success(self, key):
+        with self._lock:
+            self.health[key].record(failed=False)
+            self.health[key].exhausted = False
+            self.key_usage[key] += 1
+
+    def report_quota_error(self, key, error=None):
+        """Puts `key` on cooldown: the API's retry hint if given, else exponential backoff.
+        A daily-quota error marks the key exhausted for KEY_DAILY_COOLDOWN_SECONDS."""
+        with self._lock:
+            health = self.health[key]
+            health.record(failed=True)
+            hint = retry_after(error) if error is not None else None
+            if error is not None and "perday" in str(error).lower().replace(" ", ""):
+                health.exhausted = True
+                cooldown = config.KEY_DAILY_COOLDOWN_SECONDS
+            elif hint is not None:
+                cooldown = hint
+            else:
+                cooldown = min(config.KEY_COOLDOWN_SECONDS * 2 ** (health.consecutive_errors - 1),
+                               config.KEY_DAILY_COOLDOWN_SECONDS)
+            health.cooldown_until = max(health.cooldown_until, time.time() + cooldown)
+            print(f"⚠️ Key ...{key[-4:]} cooling down for {cooldown:.0f}s"
+                  f"{' (daily quota exhausted)' if health.exhausted else ''}.")
+        if quota_ledger is not None:
+            quota_ledger.set_cooldown(key, cooldown)
+
+    def is_exhausted(self, key):
+        return self.health[key].exhausted and self.available_in(key) > 0
+
     def switch_key(self):
-        """Rotates to the next available API key."""
+        """Marks the current key as rate-limited and moves to the healthiest available key."""
         old_key = self.current_key
-        self.current_key = next(self._key_cycle)
-        print(f"⚠️ Switching API Key: ...{old_key[-4:]} -> ...{self.current_key[-4:]}")
-        # Optional: Add a small delay to ensure the new key isn't hit immediately in a tight loop
-        time.sleep(1)
-        return self.current_key
+        self.report_quota_error(old_key)
+        key, _ = self.acquire_key()
+        print(f"⚠️ Switching API Key: ...{old_key[-4:]} -> ...{key[-4:]}")
+        return key
 
     def report_usage(self):
         self.key_usage[self.current_key] += 1
@@ -1,14 +1,24 @@
 import argparse
 import sys
 import os
+import time
 
-# Ensure src is in path if run directly
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Ensure the repo root is in path if run directly (imports are `src.chat_bot_in_API_mode.*`)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
-from src.ingester import ingester
-from src.vector_store import vector_store
+from src.chat_bot_in_API_mode.ingester import ingester, Ingester
+from src.chat_bot_in_API_mode.ingest_journal import IngestJournal
+from src.chat_bot_in_API_mode.vector_store import vector_store
+from src.chat_bot_in_API_mode.adaptive_batcher import AdaptiveBatcher
+from src.chat_bot_in_API_mode.rate_limiter import estimate_tokens
+from src.chat_bot_in_API_mode import config
+from src.shared.ingest_generation import bump_generation
 
-def run_ingest():
+def run_ingest(batch_size=0, parallel=False, restart=False):
+    """Embeds and stores all chunks.
+    batch_size=0 packs chunks adaptively (see AdaptiveBatcher); N > 0 uses fixed batches of N.
+    parallel=True embeds with one worker per API key instead (see ParallelIngester).
+    Chunks already recorded in the ingest journal are skipped unless restart=True."""
     print("🚀 Starting Ingestion Process...")
     docs = ingester.load_documents()
     if not docs:
@@ -16,16 +26,44 @@ def run_ingest():
         return
 
     chunks = ingester.split_documents(docs)
-    
-    # Batch process to be safe and efficient
-    BATCH_SIZE = 1  # Reduced batch size to mitigate Rate Limit / Quota issues
+
+    journal = IngestJournal()
+    if restart:
+        journal.reset()
+    done_ids = journal.committed_ids()
+    if done_ids:
+        chunks = [c for c in chunks if Ingester.chunk_id(c) not in done_ids]
+        print(f"⏩ Resuming: {len(done_ids)} chunks already ingested, {len(chunks)} left.")
     total_chunks = len(chunks)
-    
-    for i in range(0, total_chunks, BATCH_SIZE):
-        batch = chunks[i : i + BATCH_SIZE]
-        print(f"Processing batch {i//BATCH_SIZE + 1}/{(total_chunks + BATCH_SIZE - 1)//BATCH_SIZE}...")
-        vector_store.add_documents(batch)
-        
+
+    try:
+        if parallel:
+            from src.chat_bot_in_API_mode.parallel_ingester import ParallelIngester
+            ParallelIngester().run(chunks, journal=journal)
+        elif batch_size > 0:
+            for i in range(0, total_chunks, batch_size):
+                batch = chunks[i : i + batch_size]
+                print(f"Processing batch {i//batch_size + 1}/{(total_chunks + batch_size - 1)//batch_size}...")
+                tokens = sum(estimate_tokens(c.page_content) for c in batch)
+                vector_store.add_documents(batch, estimated_tokens=tokens)
+                journal.record(Ingester.chunk_id(c) for c in batch)
+        else:
+            batcher = AdaptiveBatcher()
+            i = 0
+            while i < total_chunks:
+                batch, tokens = batcher.fit(chunks[i : i + batcher.batch_size])
+                print(f"Processing chunks {i + 1}-{i + len(batch)}/{total_chunks} (batch={len(batch)}, ~{tokens} tokens)...")
+                started = time.time()
+                vector_store.add_documents(batch, estimated_tokens=tokens, on_quota_error=batcher.on_quota_error)
+                journal.record(Ingester.chunk_id(c) for c in batch)
+                batcher.on_success(time.time() - started)
+                i += len(batch)
+    except Exception:
+        print("💾 Progress is saved in the ingest journal. Re-run `ingest` to resume where it stopped.")
+        raise
+
+    vector_store.build_lexical_index()
+    bump_generation(config.DB_DIR)  # Invalidates caches built on the previous contents
     print("✅ Ingestion Complete.")
 
 def run_query(query_text):
@@ -43,7 +81,10 @@ def main():
     subparsers = parser.add_subparsers(dest="command", required=True)
 
     # Ingest command
-    subparsers.add_parser("ingest", help="Ingest documents from /data folder")
+    ingest_parser = subparsers.add_parser("ingest", help="Ingest documents from /data folder")
+    ingest_parser.add_argument("--batch-size", type=int, default=0, help="Fixed chunks per embedding request (default: 0 = adaptive)")
+    ingest_parser.add_argument("--parallel", action="store_true", help="Embed with one worker per key in GOOGLE_API_KEYS")
+    ingest_parser.add_argument("--restart", action="store_true", help="Ignore the ingest journal and re-embed everything (upserts, no duplicates)")
 
     # Query command (Raw Retrieval)
     query_parser = subparsers.add_parser("query", help="Raw retrieval from vector database")
@@ -61,17 +102,17 @@ def main():
     args = parser.parse_args()
 
     if args.command == "ingest":
-        run_ingest()
+        run_ingest(args.batch_size, args.parallel, args.restart)
     elif args.command == "query":
         run_query(args.text)
     elif args.command == "chat-cloud":
-        from src.chat_cloud import ChatCloud
+        from src.chat_bot_in_API_mode.chat_cloud import ChatCloud
         bot = ChatCloud(provider=args.provider)
         print(f"🤖 (Cloud - {args.provider}) Thinking...")
         answer = bot.chat(args.question)
         print(f"\n💡 Answer:\n{answer}\n")
     elif args.command == "chat-local":
-        from src.chat_local import ChatLocal
+        from src.chat_bot_in_API_mode.chat_local import ChatLocal
         bot = ChatLocal()
         print(f"🤖 (Local - Ollama) Thinking...")
         answer = bot.chat(args.question)
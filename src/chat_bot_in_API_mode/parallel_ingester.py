@@ -0,0 +1,172 @@
+import queue
+import threading
+import time
+from src.chat_bot_in_API_mode import config
+from src.chat_bot_in_API_mode.key_manager import key_manager, is_quota_error
+from src.chat_bot_in_API_mode.rate_limiter import RateLimiter
+from src.chat_bot_in_API_mode.adaptive_batcher import AdaptiveBatcher
+from src.chat_bot_in_API_mode.vector_store import vector_store
+from src.chat_bot_in_API_mode.ingester import Ingester
+
+IDLE_POLL_SECONDS = 0.5  # How often an idle worker checks for chunks given back by other workers
+
+class WorkPool:
+    """
+    Shared chunk queue plus a count of chunks taken by workers but not finished yet.
+    Chunks in flight can still come back (worker failed or its key ran out of quota),
+    so the queue is only drained once it is empty AND nothing is in flight.
+    """
+    def __init__(self, chunks):
+        self.queue = queue.Queue()
+        for chunk in chunks:
+            self.queue.put(chunk)
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def take(self, n):
+        taken = []
+        with self._lock:
+            while len(taken) < n:
+                try:
+                    taken.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            self.in_flight += len(taken)
+        return taken
+
+    def give_back(self, chunks):
+        with self._lock:
+            for chunk in chunks:
+                self.queue.put(chunk)
+            self.in_flight -= len(chunks)
+
+    def done(self, chunks):
+        with self._lock:
+            self.in_flight -= len(chunks)
+
+    def drained(self):
+        with self._lock:
+            return self.in_flight == 0 and self.queue.empty()
+
+class EmbeddingWorker(threading.Thread):
+    """
+    Embeds chunks with ONE API key, using its own rate limiter and batch sizing.
+    Results go to `result_queue` as (chunks, vectors); a final None marks the worker as done.
+    """
+    def __init__(self, api_key, pool, result_queue):
+        super().__init__(daemon=True)
+        self.api_key = api_key
+        self.pool = pool
+        self.result_queue = result_queue
+        self.embeddings = vector_store.make_embeddings(api_key)
+        self.rate_limiter = RateLimiter(api_key=api_key)
+        self.batcher = AdaptiveBatcher()
+        self.pending = []
+        self.error = None
+
+    def _next_batch(self):
+        """Next batch to embed; waits while the queue is empty but other workers still hold chunks.
+        Returns an empty batch once all work is drained."""
+        while True:
+            self.pending += self.pool.take(self.batcher.batch_size - len(self.pending))
+            if self.pending:
+                batch, tokens = self.batcher.fit(self.pending)
+                self.pending = self.pending[len(batch):]
+                return batch, tokens
+            if self.pool.drained():
+                return [], 0
+            time.sleep(IDLE_POLL_SECONDS)
+
+    def _give_back(self, batch):
+        """Returns unfinished chunks to the shared queue so other keys can take them."""
+        self.pool.give_back(batch + self.pending)
+        self.pending = []
+
+    def run(self):
+        failures = 0
+        batch = []
+        try:
+            while True:
+                batch, tokens = self._next_batch()
+                if not batch:
+                    break
+
+                # Cached texts cost no quota (and need no API call at all)
+                uncached = self.embeddings.missing([c.page_content for c in batch])
+                if uncached:
+                    self.rate_limiter.wait_if_needed(tokens)
+                started = time.time()
+                try:
+                    vectors = self.embeddings.embed_documents([c.page_content for c in batch])
+                except Exception as e:
+                    if not is_quota_error(e):
+                        raise
+                    failures += 1
+                    self.batcher.on_quota_error()
+                    key_manager.report_quota_error(self.api_key, e)
+                    if failures >= config.WORKER_MAX_FAILURES or key_manager.is_exhausted(self.api_key):
+                        print(f"🛑 Key ...{self.api_key[-4:]} keeps hitting quota. Handing its work to other keys.")
+                        self._give_back(batch)
+                        batch = []
+                        break
+                    self.pending = batch + self.pending
+                    batch = []
+                    # Sleep exactly until the key's cooldown (retry hint / backoff) ends
+                    time.sleep(key_manager.available_in(self.api_key))
+                    continue
+
+                self.batcher.on_success(time.time() - started)
+                key_manager.report_success(self.api_key)
+                failures = 0
+                self.result_queue.put((batch, vectors))
+                self.pool.done(batch)
+                batch = []
+        except Exception as e:
+            self.error = e
+            self._give_back(batch)
+            print(f"❌ Worker for key ...{self.api_key[-4:]} failed: {e}")
+        finally:
+            self.result_queue.put(None)
+
+class ParallelIngester:
+    """Runs one EmbeddingWorker per key in GOOGLE_API_KEYS; this thread is the only Chroma writer."""
+    def __init__(self, keys=None):
+        self.keys = keys or key_manager.keys
+
+    def run(self, chunks, journal=None):
+        """Embeds and stores `chunks`; raises if any chunk could not be ingested."""
+        pool = WorkPool(chunks)
+        # Bounded so workers pause instead of piling up vectors if Chroma writes fall behind
+        result_queue = queue.Queue(maxsize=len(self.keys) * 4)
+
+        workers = [EmbeddingWorker(key, pool, result_queue) for key in self.keys]
+        print(f"🚀 Starting {len(workers)} embedding workers (one per API key)...")
+        for worker in workers:
+            worker.start()
+
+        written = 0
+        running = len(workers)
+        while running:
+            item = result_queue.get()
+            if item is None:
+                running -= 1
+                continue
+            batch, vectors = item
+            vector_store.add_embeddings(batch, vectors)
+            if journal:
+                journal.record(Ingester.chunk_id(c) for c in batch)
+            written += len(batch)
+            print(f"✅ Stored {written}/{len(chunks)} chunks.")
+
+        for worker in workers:
+            worker.join()
+
+        missing = len(chunks) - written
+        errors = [worker.error for worker in workers if worker.error is not None]
+        if missing:
+            print(f"⚠️ {missing} chunks were not ingested (all keys exhausted or failed).")
+        if missing or errors:
+            if errors:
+                raise RuntimeError(f"{len(errors)} embedding worker(s) failed, {missing} chunks left") from errors[0]
+            raise RuntimeError(f"{missing} chunks were not ingested")
+        return written
@@ -0,0 +1,117 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from src.chat_bot_in_API_mode import config
+
+class QuotaLedger:
+    """
+    Host-wide record of API usage, shared by every process (ingest runs, chat-cloud sessions, ...).
+    Keeps per-key request/token events of the last minute and cooldown-until timestamps in a
+    SQLite file. Every check-and-reserve runs in a single IMMEDIATE transaction, so two
+    processes can never both take the last slot of a key.
+    """
+    WINDOW = 60.0  # seconds, same window as RPM/TPM
+
+    def __init__(self, path=config.QUOTA_LEDGER_PATH):
+        self.path = path
+        self._local = threading.local()  # sqlite3 connections must not be shared across threads
+        conn = self._connect()
+        conn.execute("CREATE TABLE IF NOT EXISTS usage (key_id TEXT, ts REAL, requests INTEGER, tokens INTEGER)")
+        conn.execute("CREATE INDEX IF NOT EXISTS usage_key_ts ON usage (key_id, ts)")
+        conn.execute("CREATE TABLE IF NOT EXISTS cooldown (key_id TEXT PRIMARY KEY, until REAL)")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def key_id(api_key):
+        """Keys are stored hashed so the ledger file never contains secrets."""
+        return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+    def _transaction(self, func):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = func(conn, time.time())
+            conn.execute("COMMIT")
+            return result
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def try_reserve(self, api_key, tokens, rpm, tpm):
+        """Records one request of `tokens` for `api_key` if the shared window has room
+        and the key is not cooling down. Returns 0 on success, else seconds to wait."""
+        key_id = self.key_id(api_key)
+        tokens = min(tokens, tpm)  # a request bigger than TPM can only wait for an empty window
+
+        def reserve(conn, now):
+            conn.execute("DELETE FROM usage WHERE ts <= ?", (now - self.WINDOW,))
+            row = conn.execute("SELECT until FROM cooldown WHERE key_id = ?", (key_id,)).fetchone()
+            if row and row[0] > now:
+                return row[0] - now
+
+            events = conn.execute(
+                "SELECT ts, requests, tokens FROM usage WHERE key_id = ? ORDER BY ts", (key_id,)
+            ).fetchall()
+            wait = 0.0
+
+            # RPM: wait until enough request events leave the window
+            excess = sum(r for _, r, _ in events) + 1 - rpm
+            wait = max(wait, self._expiry_wait(events, excess, 1, now))
+            # TPM: same for tokens
+            excess = sum(t for _, _, t in events) + tokens - tpm
+            wait = max(wait, self._expiry_wait(events, excess, 2, now))
+
+            if wait <= 0:
+                conn.execute("INSERT INTO usage VALUES (?, ?, 1, ?)", (key_id, now, tokens))
+            return wait
+
+        return self._transaction(reserve)
+
+    def _expiry_wait(self, events, excess, column, now):
+        """Seconds until the oldest events have freed at least `excess` units of `column`."""
+        if excess <= 0:
+            return 0.0
+        freed = 0
+        for event in events:
+            freed += event[column]
+            if freed >= excess:
+                return event[0] + self.WINDOW - now
+        return self.WINDOW
+
+    def adjust_tokens(self, api_key, delta):
+        """Adds a token correction (e.g. reported usage minus estimate) to the window."""
+        key_id = self.key_id(api_key)
+        self._transaction(lambda conn, now: conn.execute(
+            "INSERT INTO usage VALUES (?, ?, 0, ?)", (key_id, now, delta)))
+
+    def usage(self, api_key):
+        """(requests, tokens) used by `api_key` in the current window, across all processes."""
+        key_id = self.key_id(api_key)
+        row = self._connect().execute(
+            "SELECT COALESCE(SUM(requests), 0), COALESCE(SUM(tokens), 0) FROM usage WHERE key_id = ? AND ts > ?",
+            (key_id, time.time() - self.WINDOW)
+        ).fetchone()
+        return row[0], row[1]
+
+    def set_cooldown(self, api_key, seconds):
+        """Marks `api_key` unusable for `seconds` for every process (never shortens an existing one)."""
+        key_id = self.key_id(api_key)
+        self._transaction(lambda conn, now: conn.execute(
+            "INSERT INTO cooldown VALUES (?, ?) ON CONFLICT(key_id) DO UPDATE SET until = MAX(until, excluded.until)",
+            (key_id, now + seconds)))
+
+    def cooldown_remaining(self, api_key):
+        row = self._connect().execute(
+            "SELECT until FROM cooldown WHERE key_id = ?", (self.key_id(api_key),)
+        ).fetchone()
+        return max(0.0, row[0] - time.time()) if row else 0.0
+
+quota_ledger = QuotaLedger() if config.QUOTA_LEDGER_ENABLED else None
@@ -1,60 +1,142 @@
-import time
+import asyncio
 import functools
+import threading
+import time
 from src.chat_bot_in_API_mode import config
+from src.chat_bot_in_API_mode.quota_ledger import quota_ledger
+
+class GCRA:
+    """
+    Generic Cell Rate Algorithm: lets `limit` units through per `period` seconds, evenly spaced.
+    Only one timestamp (the theoretical arrival time) is kept, so checks are O(1)
+    and the exact wait until the next permitted request is known up front.
+    """
+    def __init__(self, limit, period=60.0, burst=0):
+        self.interval = period / limit          # seconds "paid" per unit
+        self.tolerance = burst * self.interval  # how far ahead of schedule we may run
+        self.tat = 0.0                          # theoretical arrival time
+
+    def wait_time(self, now):
+        return max(0.0, self.tat - self.tolerance - now)
+
+    def consume(self, amount, now):
+        self.tat = max(self.tat, now) + amount * self.interval
+
+    def adjust(self, amount):
+        """Charges (or refunds, if negative) `amount` units without waiting."""
+        self.tat += amount * self.interval
 
 class RateLimiter:
-    def __init__(self, rpm=config.RPM_LIMIT, tpm=config.TPM_LIMIT):
+    """
+    Paces requests within this process (GCRA). When the quota ledger is enabled and a key is
+    known, requests are reserved in the host-wide ledger instead: it already counts this
+    process together with every other process using the same key, so each request is
+    charged exactly once.
+    """
+    def __init__(self, rpm=config.RPM_LIMIT, tpm=config.TPM_LIMIT, burst=0, api_key=None):
         self.rpm = rpm
         self.tpm = tpm
-        
-        self.request_timestamps = []
-        self.token_timestamps = [] # List of (timestamp, token_count)
-
-    def _cleanup_old_timestamps(self):
-        now = time.time()
-        # Keep only timestamps within the last 60 seconds
-        self.request_timestamps = [t for t in self.request_timestamps if now - t < 60]
-        self.token_timestamps = [(t, c) for t, c in self.token_timestamps if now - t < 60]
-
-    def wait_if_needed(self, estimated_tokens=0):
-        """Pauses execution if limits are reached."""
+        self.api_key = api_key  # default key for wait_if_needed (e.g. one per parallel worker)
+        self.requests = GCRA(rpm, burst=burst)
+        self.tokens = GCRA(tpm, burst=burst * tpm / rpm)
+        self._lock = threading.Lock()
+
+    def _reserve(self, estimated_tokens):
+        """Reserves one request + tokens if allowed now (returns 0), else returns seconds to wait."""
+        with self._lock:
+            now = time.monotonic()
+            wait = max(self.requests.wait_time(now), self.tokens.wait_time(now))
+            if wait <= 0:
+                self.requests.consume(1, now)
+                self.tokens.consume(estimated_tokens, now)
+            return wait
+
+    @staticmethod
+    def _shared(api_key):
+        return quota_ledger is not None and bool(api_key)
+
+    def _try_reserve(self, estimated_tokens, api_key):
+        """Reserves against the ledger if it covers `api_key`, else locally.
+        Returns (seconds to wait, wait message); 0 means the request was reserved."""
+        if self._shared(api_key):
+            wait = quota_ledger.try_reserve(api_key, estimated_tokens, self.rpm, self.tpm)
+            return wait, f"⏳ Shared quota (key ...{api_key[-4:]}): Waiting {wait:.2f}s..."
+        wait = self._reserve(estimated_tokens)
+        return wait, f"⏳ Rate Limit: Waiting {wait:.2f}s..."
+
+    def wait_if_needed(self, estimated_tokens=0, api_key=None):
+        """Blocks exactly until the request is allowed, then reserves it."""
+        api_key = api_key or self.api_key
+        while True:
+            wait, message = self._try_reserve(estimated_tokens, api_key)
+            if wait <= 0:
+                return
+            print(message)
+            time.sleep(wait)
+
+    async def wait_if_needed_async(self, estimated_tokens=0, api_key=None):
+        """asyncio version of wait_if_needed (does not block the event loop)."""
+        api_key = api_key or self.api_key
         while True:
-            self._cleanup_old_timestamps()
-            
-            # Check RPM
-            if len(self.request_timestamps) >= self.rpm:
-                sleep_time = 1.0 # Simple wait logic
-                print(f"⏳ Rate Limit (RPM): Waiting {sleep_time}s...")
-                time.sleep(sleep_time)
-                continue
-            
-            # Check TPM
-            current_tokens = sum(c for _, c in self.token_timestamps)
-            if current_tokens + estimated_tokens > self.tpm:
-                sleep_time = 1.0
-                print(f"⏳ Rate Limit (TPM): Waiting {sleep_time}s...")
-                time.sleep(sleep_time)
-                continue
-                
-            break
-            
-    def record_request(self, tokens=0):
-        now = time.time()
-        self.request_timestamps.append(now)
-        self.token_timestamps.append((now, tokens))
+            wait, message = self._try_reserve(estimated_tokens, api_key)
+            if wait <= 0:
+                return
+            print(message)
+            await asyncio.sleep(wait)
+
+    def reconcile(self, estimated_tokens, actual_tokens, api_key=None):
+        """Corrects the token reservation once the API reports real usage."""
+        api_key = api_key or self.api_key
+        if self._shared(api_key):
+            quota_ledger.adjust_tokens(api_key, actual_tokens - estimated_tokens)
+            return
+        with self._lock:
+            self.tokens.adjust(actual_tokens - estimated_tokens)
 
 rate_limiter = RateLimiter()
 
-def limit_rate(estimated_tokens=0):
-    """Decorator to apply rate limiting."""
+def estimate_tokens(text):
+    """Rough token count for a text (~4 UTF-8 bytes per token, rounded up).
+    Vietnamese/Pali diacritics take 2-3 bytes, so this errs on the safe side."""
+    return len(text.encode("utf-8")) // 4 + 1
+
+def _reported_tokens(result):
+    """Total tokens from a LangChain AIMessage's usage_metadata, or None if not reported."""
+    usage = getattr(result, "usage_metadata", None)
+    if usage:
+        return usage.get("total_tokens")
+    return None
+
+def limit_rate(estimated_tokens=0, count_tokens=None, api_key=None):
+    """Decorator to apply rate limiting (works on sync and async functions).
+    `count_tokens(*args, **kwargs)` estimates tokens from the call's arguments;
+    results carrying usage_metadata are reconciled against the estimate.
+    `api_key`: charge this key (in the shared ledger when enabled) instead of the process-wide budget."""
     def decorator(func):
+        def estimate(args, kwargs):
+            return count_tokens(*args, **kwargs) if count_tokens else estimated_tokens
+
+        def settle(tokens, result):
+            actual = _reported_tokens(result)
+            if actual is not None:
+                rate_limiter.reconcile(tokens, actual, api_key=api_key)
+
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                tokens = estimate(args, kwargs)
+                await rate_limiter.wait_if_needed_async(tokens, api_key=api_key)
+                result = await func(*args, **kwargs)
+                settle(tokens, result)
+                return result
+            return async_wrapper
+
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
-            rate_limiter.wait_if_needed(estimated_tokens)
+            tokens = estimate(args, kwargs)
+            rate_limiter.wait_if_needed(tokens, api_key=api_key)
             result = func(*args, **kwargs)
-            # Roughly estimate tokens if not provided or refine after call?
-            # For simplicity, we record the estimated tokens upfront or 0.
-            rate_limiter.record_request(estimated_tokens)
+            settle(tokens, result)
             return result
         return wrapper
     return decorator
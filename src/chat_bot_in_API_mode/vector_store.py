@@ -1,10 +1,13 @@
 import time
-import google.api_core.exceptions
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from langchain_chroma import Chroma
 from src.chat_bot_in_API_mode import config
-from src.chat_bot_in_API_mode.chat_bot_in_API_mode.key_manager import key_manager
-from src.chat_bot_in_API_mode.chat_bot_in_API_mode.rate_limiter import rate_limiter
+from src.chat_bot_in_API_mode.key_manager import key_manager, is_quota_error
+from src.chat_bot_in_API_mode.rate_limiter import rate_limiter, estimate_tokens
+from src.chat_bot_in_API_mode.ingester import Ingester
+from src.shared.embedding_cache import CachedEmbeddings
+from src.shared.lexical_index import LexicalIndex, HybridRetriever
+from src.shared.retrieval_cache import RetrievalCache, CachedRetriever
 
 class VectorStore:
     def __init__(self):
@@ -14,13 +17,28 @@ class VectorStore:
             persist_directory=self.persist_directory,
             embedding_function=self.embeddings
         )
+        # Repeated (query, k, filter) skip both the embedding call and the Chroma search
+        self.retrieval_cache = RetrievalCache(self.persist_directory)
 
     def _init_embeddings(self):
         """Initializes embeddings with the current active key."""
-        return GoogleGenerativeAIEmbeddings(
-            model="models/text-embedding-004", 
-            google_api_key=key_manager.get_current_key(),
-            task_type="retrieval_document"
+        self.active_key = key_manager.get_current_key()
+        return self.make_embeddings(self.active_key)
+
+    @staticmethod
+    def make_embeddings(api_key):
+        """Creates an embedding client bound to one specific API key.
+        Wrapped in the on-disk cache, so only never-seen text reaches the API."""
+        return CachedEmbeddings(
+            GoogleGenerativeAIEmbeddings(
+                model="models/text-embedding-004", 
+                google_api_key=api_key,
+                task_type="retrieval_document"
+            ),
+            "models/text-embedding-004",
+            config.EMBED_CACHE_PATH,
+            instruction="retrieval_document",
+            max_entries=config.EMBED_CACHE_MAX_ENTRIES
         )
     
     def _refresh_embeddings(self):
@@ -29,38 +47,49 @@ class VectorStore:
         # Update the DB's embedding function reference if needed
         self.db._embedding_function = self.embeddings
 
-    def add_documents(self, chunks):
-        """Adds documents to ChromaDB with retry logic for Quota errors."""
+    def _acquire_key(self):
+        """Switches to the healthiest key, sleeping only if every key is cooling down."""
+        key, wait = key_manager.acquire_key()
+        if wait > 0:
+            print(f"🛑 All keys are cooling down. Sleeping {wait:.1f}s until key ...{key[-4:]} is ready...")
+            time.sleep(wait)
+        if key != self.active_key:
+            self._refresh_embeddings()
+        return key
+
+    def add_documents(self, chunks, estimated_tokens=0, on_quota_error=None):
+        """Adds (upserts, by chunk ID) documents to ChromaDB with retry logic for Quota errors.
+        `on_quota_error` is called on every quota error (e.g. to shrink the next batch)."""
         attempt = 0
         # Allow cycling through all keys multiple times (e.g., 3 rounds)
         max_attempts = len(key_manager.keys) * 3 
         
+        # Cached texts cost no quota: only charge for the ones the API will actually see
+        uncached = self.embeddings.missing([c.page_content for c in chunks])
+        if len(uncached) < len(chunks):
+            estimated_tokens = sum(estimate_tokens(t) for t in uncached)
+
         while attempt < max_attempts:
+            key = self._acquire_key()
             # Apply Rate Limiting
-            rate_limiter.wait_if_needed()
+            if uncached:
+                rate_limiter.wait_if_needed(estimated_tokens, api_key=key)
 
             try:
-                self.db.add_documents(chunks)
-                rate_limiter.record_request()
+                # Embedding responses carry no usage metadata, so the estimate stands
+                self.db.add_documents(chunks, ids=[Ingester.chunk_id(c) for c in chunks])
+                key_manager.report_success(key)
                 print(f"✅ Added {len(chunks)} chunks to DB.")
                 return  # Success
             except Exception as e:
                 # Check for Quota/ResourceExhausted errors
-                is_quota_error = "429" in str(e) or "ResourceExhausted" in str(e)
-                
-                if is_quota_error:
-                    print(f"❌ Quota exceeded (Attempt {attempt+1}/{max_attempts}). Switching key...")
-                    key_manager.switch_key()
-                    self._refresh_embeddings()
+                if is_quota_error(e):
+                    print(f"❌ Quota exceeded (Attempt {attempt+1}/{max_attempts}).")
+                    if on_quota_error:
+                        on_quota_error()
+                    # Cooldown from the retry hint; the next _acquire_key skips this key
+                    key_manager.report_quota_error(key, e)
                     attempt += 1
-                    
-                    # If we've tried all keys, wait significantly longer before next round
-                    if attempt > 0 and attempt % len(key_manager.keys) == 0:
-                        wait_time = 20 * (attempt // len(key_manager.keys))
-                        print(f"🛑 All keys hit limits. Sleeping {wait_time}s to cool down...")
-                        time.sleep(wait_time)
-                    else:
-                        time.sleep(2) # Short wait for key switch
                 else:
                     print(f"❌ Error adding documents: {e}")
                     raise e
@@ -68,29 +97,55 @@ class VectorStore:
         print("❌ Failed to add documents after multiple attempts/key rotations.")
         raise Exception("Persistent Quota Exceeded across all provided API keys.")
 
+    def add_embeddings(self, chunks, vectors):
+        """Writes chunks whose embeddings were already computed (no API call)."""
+        self.db._collection.upsert(
+            ids=[Ingester.chunk_id(c) for c in chunks],
+            embeddings=vectors,
+            documents=[c.page_content for c in chunks],
+            metadatas=[c.metadata for c in chunks]
+        )
+
+    def as_retriever(self, k=5):
+        """Hybrid BM25 + vector retriever if the lexical index was built, else plain vector search."""
+        if LexicalIndex.exists(config.LEXICAL_INDEX_DIR):
+            return HybridRetriever(vectorstore=self.db, index=LexicalIndex(config.LEXICAL_INDEX_DIR), k=k,
+                                   cache=self.retrieval_cache)
+        return CachedRetriever(vectorstore=self.db, cache=self.retrieval_cache, k=k)
+
+    def build_lexical_index(self):
+        """(Re)builds the BM25 index over every chunk currently in ChromaDB."""
+        return LexicalIndex.build_from_chroma(self.db, config.LEXICAL_INDEX_DIR)
+
     def query(self, query_text, k=5):
         """Queries the database."""
         # Querying also consumes quota, should rate limit?
         # Typically retrieval query is cheap/free on some models or consumes read quota.
         # Embedding the query string consumes quota.
         
+        cached = self.retrieval_cache.lookup(self.db, query_text, k)
+        if cached is not None:
+            return [doc for doc, _ in cached]
+
         retries = 0
         while retries < len(key_manager.keys) * 2:
+            key = self._acquire_key()
+            if (not self.retrieval_cache.has_vector(self.embeddings, query_text)
+                    and self.embeddings.missing([query_text], kind="query")):
+                rate_limiter.wait_if_needed(estimate_tokens(query_text), api_key=key)
             try:
                 # Need to update embedding function if key changed previously? 
                 # Yes, make sure db uses current embeddings
                 self.db._embedding_function = self.embeddings
                 
-                results = self.db.similarity_search(query_text, k=k)
-                return results
+                results = self.retrieval_cache.search(self.db, query_text, k)
+                key_manager.report_success(key)
+                return [doc for doc, _ in results]
             except Exception as e:
-                is_quota_error = "429" in str(e) or "ResourceExhausted" in str(e)
-                if is_quota_error:
-                    print(f"❌ Quota exceeded during query. Switching key...")
-                    key_manager.switch_key()
-                    self._refresh_embeddings()
+                if is_quota_error(e):
+                    print(f"❌ Quota exceeded during query.")
+                    key_manager.report_quota_error(key, e)
                     retries += 1
-                    time.sleep(1)
                 else:
                     raise e
         return []
@@ -0,0 +1,70 @@
+"""
+Cache câu trả lời theo ngữ nghĩa: câu hỏi mới đủ giống (cosine >= threshold) một câu hỏi đã trả lời,
+cùng bộ lọc kinh, thì dùng lại câu trả lời cũ thay vì chạy lại LLM.
+Giới hạn số mục (LRU) và tuổi thọ (TTL); tự xóa toàn bộ khi DB được ingest lại (số thế hệ đổi).
+"""
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from src.shared.ingest_generation import read_generation
+
+class CachedAnswer:
+    def __init__(self, vector, filter_key, answer, sources):
+        self.vector = vector
+        self.filter_key = filter_key
+        self.answer = answer
+        self.sources = sources          # [(tên nguồn, nội dung)] để hiển thị lại
+        self.created = time.time()
+
+class AnswerCache:
+    def __init__(self, db_dir, threshold=0.95, max_entries=512, ttl_seconds=24 * 3600):
+        self.db_dir = db_dir
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()   # id -> CachedAnswer, cũ nhất ở đầu
+        self._next_id = 0
+        self._generation = read_generation(db_dir)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _check_generation(self):
+        generation = read_generation(self.db_dir)
+        if generation != self._generation:
+            print(f"♻️ DB đã được ingest lại (thế hệ {self._generation} -> {generation}): xóa cache câu trả lời")
+            self._entries.clear()
+            self._generation = generation
+
+    def get(self, query_vector, filter_key=None):
+        """CachedAnswer giống nhất (cùng filter, cosine >= threshold) hoặc None."""
+        with self._lock:
+            self._check_generation()
+            now = time.time()
+            for entry_id in [i for i, e in self._entries.items() if now - e.created > self.ttl_seconds]:
+                del self._entries[entry_id]
+
+            same_filter = [(i, e) for i, e in self._entries.items() if e.filter_key == filter_key]
+            if not same_filter:
+                return None
+            similarities = np.stack([e.vector for _, e in same_filter]) @ self._normalize(query_vector)
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                return None
+            entry_id, entry = same_filter[best]
+            self._entries.move_to_end(entry_id)  # vừa dùng => xóa sau cùng
+            print(f"⚡ Answer cache hit (cosine={similarities[best]:.3f})")
+            return entry
+
+    def put(self, query_vector, filter_key, answer, sources):
+        with self._lock:
+            self._check_generation()
+            self._entries[self._next_id] = CachedAnswer(self._normalize(query_vector), filter_key, answer, sources)
+            self._next_id += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
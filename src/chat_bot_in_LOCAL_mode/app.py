@@ -1,16 +1,20 @@
 import chainlit as cl
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.vectorstores import Chroma
 from langchain_ollama import ChatOllama
 # sử dụng langchain_core
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.runnables import RunnablePassthrough
 from langchain_core.output_parsers import StrOutputParser
+import os, sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))) # Thư mục gốc repo: src.shared.*
+from shared_resources import get_embeddings, get_vectorstore
 
 # --- CẤU HÌNH ---
 DB_PATH = "./chroma_db"  # Đường dẫn tới folder DB bạn vừa tạo
 EMBEDDING_MODEL = "intfloat/multilingual-e5-large-instruct" # Phải khớp với model lúc Ingest
 LLM_MODEL = "qwen2.5:7b" # Model chạy trên Ollama
+EMBED_CACHE_PATH = "./embedding_cache.sqlite3" # Câu hỏi lặp lại không cần vector hóa lại
 
 
 llm = ChatOllama(
@@ -19,6 +23,10 @@ llm = ChatOllama(
     base_url="http://localhost:11434"
 )
 
+# Load 1 lần khi server khởi động, dùng chung cho mọi session
+EMBEDDING = get_embeddings(EMBEDDING_MODEL, cache_path=EMBED_CACHE_PATH) # torch fp32: GPU nếu có (1050Ti), không thì CPU
+VECTORSTORE = get_vectorstore(DB_PATH, EMBEDDING)
+
 def extract_filter(user_query, llm):
     """
     Hàm này dùng LLM để trích xuất tên kinh từ câu hỏi.
@@ -56,19 +64,9 @@ async def on_chat_start():
     msg = cl.Message(content="🙏 Đang khởi động hệ thống Chatbot Phật học...")
     await msg.send()
 
-    # A. Load Embedding Model (Chạy trên GPU 1050Ti)
-    embedding = HuggingFaceEmbeddings(
-        model_name=EMBEDDING_MODEL,
-        model_kwargs={'device': 'cuda'}, # Dùng GPU để vector hóa câu hỏi user cho nhanh
-        encode_kwargs={'normalize_embeddings': True}
-    )
+    # A + B. Embedding model và ChromaDB đã load sẵn lúc khởi động server (dùng chung mọi session)
+    vectorstore = VECTORSTORE
 
-    # B. Load ChromaDB
-    vectorstore = Chroma(
-        persist_directory=DB_PATH,
-        embedding_function=embedding
-    )
-    
     # C. Tạo Retriever (Người tìm kiếm)
     # k=3: Lấy 3 đoạn kinh văn liên quan nhất
     retriever = vectorstore.as_retriever(
@@ -1,11 +1,24 @@
 import chainlit as cl
 from langchain_ollama import ChatOllama
-from langchain_chroma import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.runnables import RunnablePassthrough
 from langchain_core.output_parsers import StrOutputParser
-import os, difflib, re
+import os, sys, difflib, re, asyncio, threading
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))) # Thư mục gốc repo: src.shared.*
+from shared_resources import get_embeddings, get_vectorstore, get_reranker
+from sutta_router import SuttaRouter
+from src.shared.lexical_index import LexicalIndex, HybridRetriever
+from quote_index import QuoteIndex, looks_like_quote
+from answer_cache import AnswerCache
+from src.shared.retrieval_cache import RetrievalCache
+from flat_index import FlatIndex, read_index_mode
+from quantized_index import QuantizedIndex
+from dim_reduction import ReducedIndex, reduced_path
+from bilingual_index import BilingualIndex, query_language
+from src.shared.ingest_generation import read_generation
+from embedding_backend import verify_against_store, resolve_backend
 
 # ==================================================
 # 1. CẤU HÌNH & XỬ LÝ DỮ LIỆU LIST.MD (QUAN TRỌNG)
@@ -50,6 +63,12 @@ def load_and_parse_list_kinh(file_path):
 # Load dữ liệu
 LIST_FILE_PATH = "data/Truong_Bo_Kinh_Final/list.md"
 LIST_KINH_FULL, LIST_METADATA_CLEAN = load_and_parse_list_kinh(LIST_FILE_PATH)
+# Router tra từ vựng (tên Pali/Việt, bỏ dấu, số kinh): thay cho việc gọi LLM ở mọi tin nhắn
+SUTTA_ROUTER = SuttaRouter(LIST_FILE_PATH) if os.path.exists(LIST_FILE_PATH) else None
+# Tra trích dẫn nguyên văn (dựng trong ~1-2s lúc khởi động, mỗi lần tra < 1ms)
+QUOTE_INDEX = (QuoteIndex.build(os.path.dirname(LIST_FILE_PATH), "truong_bo_kinh.leann.passages.jsonl")
+               if os.path.isdir(os.path.dirname(LIST_FILE_PATH)) else None)
+MAX_QUOTE_HITS = 10
 
 print(f"DEBUG: Đã load {len(LIST_METADATA_CLEAN)} kinh target.")
 
@@ -91,13 +110,78 @@ def normalize_kinh_name(llm_output, metadata_list):
 OLLAMA_URL = "http://localhost:11434"
 MODEL_NAME = "qwen2.5:7b"
 EMBEDDING_MODEL = "intfloat/multilingual-e5-large-instruct"
+EMBEDDING_BACKEND = "auto" # GPU: torch fp32; chỉ có CPU: int8 (xem embedding_backend.py), hoặc "onnx"
+EMBEDDING_CHECK_SAMPLE = 4 # Số chunk embed lại lúc khởi động để so với vector trong DB; lệch => quay về torch fp32
 DB_VECTOR="./chroma_db3"
+LEXICAL_INDEX_PATH = os.path.join(DB_VECTOR, "bm25") # Dựng bởi data2vector_optimized.py
+FLAT_INDEX_PATH = os.path.join(DB_VECTOR, "flat") # Có thì tìm vector bằng NumPy thay vì Chroma/HNSW
+VECTOR_INDEX_MODE = "float16" # Hoặc "int8" / "binary": mã lượng tử hóa trong RAM + chấm lại bằng vector gốc
+VECTOR_INDEX_RESCORE = 10 # Số ứng viên chấm lại = RESCORE * k (xem báo cáo của quantized_index.py)
+VECTOR_INDEX_WIDTH = None # Vd. 256: dùng bản PCA rút gọn flat_pca256 (xem benchmark của dim_reduction.py)
+QUERY_INSTRUCT = "Instruct: Given a web search query, retrieve relevant passages that answer the query\nQuery: "
+EMBED_CACHE_PATH="./embedding_cache.sqlite3" # Cache vector câu hỏi (dùng chung với data2vector)
+TOP_K = 3
+OVERFETCH_K = 30 # Tìm toàn cục trước khi biết kinh; lọc lại từ tập này nếu Router chọn được kinh
+RERANK_MODEL = "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1" # Đặt None để tắt bước rerank
+RERANK_TIME_BUDGET = 1.0 # Giây/câu hỏi; vượt quá thì giữ thứ tự tìm kiếm ban đầu
+ANSWER_CACHE_THRESHOLD = 0.95 # Cosine tối thiểu giữa 2 câu hỏi để dùng lại câu trả lời
+ANSWER_CACHE_TTL = 24 * 3600 # Giây
+
+# Load 1 lần khi server khởi động, dùng chung cho mọi session (RAM không tăng theo số người dùng)
+EMBEDDINGS = get_embeddings(EMBEDDING_MODEL, cache_path=EMBED_CACHE_PATH, backend=EMBEDDING_BACKEND)
+VECTORSTORE = get_vectorstore(DB_VECTOR, EMBEDDINGS) if os.path.exists(DB_VECTOR) else None
+if VECTORSTORE is not None and resolve_backend(EMBEDDING_BACKEND)[0] != "torch":
+    # Backend int8/onnx chỉ xấp xỉ vector fp32 lúc ingest: lệch quá ngưỡng (hoặc không kiểm tra được)
+    # => dùng torch fp32 như data2vector_optimized, không phục vụ bằng vector câu hỏi sai lệch
+    ok = EMBEDDING_CHECK_SAMPLE and verify_against_store(EMBEDDINGS.embeddings, VECTORSTORE._collection,
+                                                         sample=EMBEDDING_CHECK_SAMPLE)[0]
+    if not ok:
+        print(f"⚠️ Backend {EMBEDDING_BACKEND} không khớp vector trong {DB_VECTOR} => chuyển sang torch (fp32)")
+        EMBEDDINGS = get_embeddings(EMBEDDING_MODEL, cache_path=EMBED_CACHE_PATH, backend="torch")
+        VECTORSTORE = get_vectorstore(DB_VECTOR, EMBEDDINGS)
+# BM25 + vector (RRF): bắt được thuật ngữ Pali / cụm từ chính xác mà e5 bỏ sót
+HYBRID = None
+if VECTORSTORE is not None and LexicalIndex.exists(LEXICAL_INDEX_PATH):
+    HYBRID = HybridRetriever(vectorstore=VECTORSTORE, index=LexicalIndex(LEXICAL_INDEX_PATH),
+                             k=TOP_K, fetch_k=OVERFETCH_K, query_prefix=QUERY_INSTRUCT)
+RERANKER = get_reranker(RERANK_MODEL, device="cpu", time_budget=RERANK_TIME_BUDGET) if RERANK_MODEL else None
+ANSWER_CACHE = AnswerCache(DB_VECTOR, threshold=ANSWER_CACHE_THRESHOLD, ttl_seconds=ANSWER_CACHE_TTL)
+RETRIEVAL_CACHE = RetrievalCache(DB_VECTOR) # (câu hỏi, k, filter) -> chunk id + vector câu hỏi
+_flat_index = {"generation": None, "index": None}
+_flat_index_lock = threading.Lock() # get_flat_index được gọi từ nhiều thread của cl.make_async
+
+def get_flat_index():
+    """FlatIndex hiện tại (load lại mỗi khi data2vector_optimized ghi lại DB hoặc một chỉ mục dẫn xuất),
+    hoặc None nếu chưa export.
+    DB ingest song ngữ (index_mode ghi trong sidecar lúc export) => BilingualIndex: tìm từng dòng, trả về cả cặp."""
+    generation = read_generation(DB_VECTOR)
+    with _flat_index_lock:
+        if _flat_index["generation"] != generation:
+            if FlatIndex.exists(FLAT_INDEX_PATH) and read_index_mode(FLAT_INDEX_PATH) == "bilingual":
+                _flat_index["index"] = BilingualIndex(FLAT_INDEX_PATH)
+            elif VECTOR_INDEX_MODE != "float16" and QuantizedIndex.exists(FLAT_INDEX_PATH, VECTOR_INDEX_MODE):
+                _flat_index["index"] = QuantizedIndex(FLAT_INDEX_PATH, VECTOR_INDEX_MODE, rescore=VECTOR_INDEX_RESCORE)
+            elif VECTOR_INDEX_WIDTH and ReducedIndex.exists(reduced_path(FLAT_INDEX_PATH, VECTOR_INDEX_WIDTH)):
+                _flat_index["index"] = ReducedIndex(reduced_path(FLAT_INDEX_PATH, VECTOR_INDEX_WIDTH))
+            else:
+                if FlatIndex.exists(FLAT_INDEX_PATH) and (VECTOR_INDEX_MODE != "float16" or VECTOR_INDEX_WIDTH):
+                    print(f"⚠️ Chưa có chỉ mục cho VECTOR_INDEX_MODE={VECTOR_INDEX_MODE}, VECTOR_INDEX_WIDTH={VECTOR_INDEX_WIDTH}: "
+                          "dùng float16 (chạy lại data2vector_optimized.py, width phải có trong REDUCED_WIDTHS)")
+                _flat_index["index"] = FlatIndex(FLAT_INDEX_PATH) if FlatIndex.exists(FLAT_INDEX_PATH) else None
+            _flat_index["generation"] = generation
+        return _flat_index["index"]
+LLM = ChatOllama(
+    base_url=OLLAMA_URL,
+    model=MODEL_NAME,
+    temperature=0.2 # Router cần chính xác, temperature thấp
+)
 # ==================================================
 # 2. HÀM ROUTER (TRÍCH XUẤT FILTER)
 # ==================================================
-def extract_filter(query: str, llm):
+def extract_filter(query: str, llm, list_kinh=None):
     """
     Hàm này hỏi LLM xem câu hỏi thuộc về bộ kinh nào trong LIST_KINH.
+    `list_kinh`: chỉ gửi các dòng ứng viên (mặc định: toàn bộ LIST_KINH_FULL).
     """
     router_template = """
     Bạn là một trợ lý phân loại tài liệu Phật giáo.
@@ -119,7 +203,7 @@ def extract_filter(query: str, llm):
     
     try:
         # Gửi FULL LIST cho LLM để nó có ngữ cảnh (bao gồm cả tên Pali và Việt ở cột đầu)
-        result = chain.invoke({"list_kinh": "\n".join(LIST_KINH_FULL), "question": query})
+        result = chain.invoke({"list_kinh": "\n".join(list_kinh or LIST_KINH_FULL), "question": query})
         cleaned_result = result.strip().replace("'", "").replace('"', "")
         return cleaned_result
     except Exception as e:
@@ -131,39 +215,14 @@ def extract_filter(query: str, llm):
 # ==================================================
 @cl.on_chat_start
 async def on_chat_start():
-    print("--- Bắt đầu khởi tạo App ---")
-    
-    # A. Load Embeddings 
-    model_kwargs = {'device': 'cpu'} # Hoặc cuda
-    encode_kwargs = {'normalize_embeddings': True}
-    embeddings = HuggingFaceEmbeddings(
-        model_name=EMBEDDING_MODEL,
-        model_kwargs=model_kwargs,
-        encode_kwargs=encode_kwargs,
-        multi_process=False
-    )
-    
-    # B. Load VectorStore (Chroma)
-    # Giả sử bạn lưu DB ở thư mục "./chroma_db"
-    if not os.path.exists(DB_VECTOR):
-         await cl.Message("⚠️ Lỗi: Không tìm thấy thư mục './chroma_db2'. Vui lòng Ingest dữ liệu trước!").send()
+    # Embeddings, Chroma và LLM đã load sẵn lúc khởi động server => session mới gần như tức thì
+    if VECTORSTORE is None:
+         await cl.Message(f"⚠️ Lỗi: Không tìm thấy thư mục '{DB_VECTOR}'. Vui lòng Ingest dữ liệu trước!").send()
          return
 
-    vectorstore = Chroma(
-        persist_directory=DB_VECTOR,
-        embedding_function=embeddings # Đổi tên collection nếu bạn đặt khác
-    )
-    
-    # C. Load LLM (Ollama)
-    llm = ChatOllama(
-        base_url=OLLAMA_URL,
-        model=MODEL_NAME,
-        temperature=0.2 # Router cần chính xác, temperature thấp
-    )
-    
-    # D. Lưu vào Session để dùng lại ở mỗi tin nhắn
-    cl.user_session.set("vectorstore", vectorstore)
-    cl.user_session.set("llm", llm)
+    # Lưu vào Session để dùng lại ở mỗi tin nhắn (chỉ là tham chiếu tới object dùng chung)
+    cl.user_session.set("vectorstore", VECTORSTORE)
+    cl.user_session.set("llm", LLM)
     
     await cl.Message(content="Trợ lý ảo đã sẵn sàng!").send()
 
@@ -175,20 +234,65 @@ async def on_message(message: cl.Message):
     llm = cl.user_session.get("llm")
     vectorstore = cl.user_session.get("vectorstore")
     
-    user_query = f"Instruct: Given a web search query, retrieve relevant passages that answer the query\nQuery: {message.content}"
+    user_query = f"{QUERY_INSTRUCT}{message.content}"
+
+    # Người dùng dán nguyên văn một câu kinh -> trả về chính xác kinh/đoạn, không cần RAG
+    if QUOTE_INDEX is not None and looks_like_quote(message.content):
+        hits, seen = [], set()
+        for hit in QUOTE_INDEX.find(message.content):
+            # passages.jsonl của LEANN trùng nội dung với các file .md => bỏ bản lặp
+            if (hit.source, hit.text) not in seen:
+                seen.add((hit.source, hit.text))
+                hits.append(hit)
+        if hits:
+            lines = [f"📜 Tìm thấy **{len(hits)}** chỗ có nguyên văn này:"]
+            elements = []
+            for i, hit in enumerate(hits[:MAX_QUOTE_HITS]):
+                lines.append(f"{i+1}. {hit.header_path} — đoạn {hit.paragraph} (`{hit.source}`)")
+                elements.append(cl.Text(content=hit.text, name=f"Trích dẫn {i+1}", display="side"))
+            if len(hits) > MAX_QUOTE_HITS:
+                lines.append(f"... và {len(hits) - MAX_QUOTE_HITS} chỗ khác.")
+            await cl.Message(content="\n".join(lines), elements=elements).send()
+            return
     
     msg_processing = cl.Message(content="🤔 Đang suy nghĩ...")
     await msg_processing.send()
+
+    # 0. Tìm kiếm toàn cục chạy NGAY, song song với Router (embed câu hỏi 1 lần, dùng lại vector)
+    def vector_search(query_vector, k, filter=None, partition=None):
+        flat_index = get_flat_index()
+        if flat_index:
+            # Exact top-k bằng một phép nhân ma trận (< 1ms). Đã biết kinh => chỉ quét partition
+            # (các hàng liền nhau của kinh đó) thay vì lọc $or trên toàn bộ DB
+            if partition and flat_index.rows(partition) is not None:
+                filter = None
+            else:
+                partition = None # Tên không có partition (vd. khớp Ten_bo_kinh): giữ filter $or
+            if isinstance(flat_index, BilingualIndex):
+                # Câu hỏi tiếng Việt thuần => chỉ quét các dòng tiếng Việt
+                return flat_index.search_by_vector(query_vector, k, filter, partition, lang=query_language(message.content))
+            return flat_index.search_by_vector(query_vector, k, filter, partition)
+        return RETRIEVAL_CACHE.search(vectorstore, user_query, k, filter=filter, query_vector=query_vector)
+
+    def global_search():
+        query_vector = RETRIEVAL_CACHE.embed(vectorstore.embeddings, user_query)
+        return query_vector, [doc for doc, _ in vector_search(query_vector, OVERFETCH_K)]
+    global_task = asyncio.ensure_future(cl.make_async(global_search)())
     
-    # 1. Router chạy
-    detected_kinh_raw = await cl.make_async(extract_filter)(user_query, llm)
-    print(f"🤖 Router Output: {detected_kinh_raw}") # VD: 1. Brahmajālasuttaṃ
-    
-    # 2. Chuẩn hóa: Map output của LLM vào LIST_METADATA_CLEAN
-    detected_kinh = normalize_kinh_name(detected_kinh_raw, LIST_METADATA_CLEAN)
+    # 1. Router tra từ vựng (micro giây). Chỉ khi câu hỏi khớp nhiều kinh mới hỏi LLM,
+    #    và chỉ gửi các dòng ứng viên thay vì toàn bộ danh sách
+    def resolve_with_llm(query, candidates):
+        detected_kinh_raw = extract_filter(query, llm, [c.line for c in candidates])
+        print(f"🤖 Router Output: {detected_kinh_raw}") # VD: 1. Brahmajālasuttaṃ
+        # 2. Chuẩn hóa: Map output của LLM vào key của các ứng viên
+        return normalize_kinh_name(detected_kinh_raw, [c.key for c in candidates])
+
+    detected_kinh = None
+    if SUTTA_ROUTER:
+        detected_kinh = await cl.make_async(SUTTA_ROUTER.route)(message.content, resolve_with_llm)
     print(f"🎯 DB Key Normalized: {detected_kinh}")
 
-    search_kwargs = {"k": 3}
+    search_kwargs = {"k": TOP_K}
     
     if detected_kinh:
         # QUAN TRỌNG: Lúc này detected_kinh đã khớp 100% với DB Metadata
@@ -206,13 +310,43 @@ async def on_message(message: cl.Message):
 
     print(f"DEBUG FILTER KWARGS: {search_kwargs}") # Kiểm tra lần cuối ở đây
 
-    # 3. Retrieve
-    retriever = vectorstore.as_retriever(
-        search_type="similarity",
-        search_kwargs=search_kwargs
-    )
-    
-    docs = await retriever.ainvoke(user_query)
+    # 3. Retrieve: kết quả toàn cục thường đã xong trong lúc Router chạy
+    query_vector, candidates = await global_task
+
+    # Câu hỏi (gần) trùng với câu đã trả lời, cùng kinh => stream lại câu trả lời cũ, bỏ qua LLM
+    cached = ANSWER_CACHE.get(query_vector, detected_kinh)
+    if cached:
+        res = cl.Message(content=filter_msg + "\n\n",
+                         elements=[cl.Text(content=text, name=name, display="side") for name, text in cached.sources])
+        for piece in re.findall(r"\S+\s*", cached.answer):
+            await res.stream_token(piece)
+        await res.send()
+        await msg_processing.remove()
+        return
+
+    if detected_kinh:
+        # Lọc lại tập over-fetch; chỉ khi không đủ TOP_K mới tìm lại có filter (không embed lại)
+        vector_docs = [d for d in candidates
+                       if detected_kinh in (d.metadata.get("Ten_bai_kinh"), d.metadata.get("Ten_bo_kinh"))]
+        if len(vector_docs) < TOP_K:
+            results = await cl.make_async(vector_search)(query_vector, OVERFETCH_K, search_kwargs["filter"], detected_kinh)
+            vector_docs = [doc for doc, _ in results]
+    else:
+        vector_docs = candidates
+
+    # Giữ cả tập ứng viên nếu còn rerank, nếu không thì chỉ lấy TOP_K
+    pool_size = OVERFETCH_K if RERANKER else TOP_K
+    if HYBRID:
+        # Trộn với BM25 trên câu hỏi gốc (không có instruction)
+        docs = await cl.make_async(HYBRID.fuse)(vector_docs, message.content, filter=search_kwargs.get("filter"), k=pool_size)
+    else:
+        docs = vector_docs[:pool_size]
+    flat_index = get_flat_index()
+    if isinstance(flat_index, BilingualIndex):
+        # Trúng dòng Pali hay dòng Việt đều trả về cả cặp đã căn dòng (bỏ trùng khi cả 2 dòng cùng trúng)
+        docs = flat_index.to_pairs(docs)
+    if RERANKER:
+        docs = await cl.make_async(RERANKER.rerank)(message.content, docs, TOP_K)
     
     # Debug in ra terminal (nếu muốn)
     print(f"DEBUG: Tìm thấy {len(docs)} docs")
@@ -261,8 +395,11 @@ async def on_message(message: cl.Message):
     res = cl.Message(content=filter_msg + "\n\n", elements=source_elements)
     
     # Chạy chain với input trực tiếp
+    answer = []
     async for chunk in runnable.astream({"context": context_str, "question": user_query}):
+        answer.append(chunk)
         await res.stream_token(chunk)
     
     await res.send()
+    ANSWER_CACHE.put(query_vector, detected_kinh, "".join(answer), [(e.name, e.content) for e in source_elements])
     await msg_processing.remove()
\ No newline at end of file
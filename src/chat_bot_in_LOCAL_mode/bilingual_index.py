@@ -0,0 +1,68 @@
+"""
+Chỉ mục song ngữ trên FlatIndex: mỗi dòng Pali / Việt là một vector riêng (xem
+ScriptureSplitter.split_bilingual), hai dòng của cùng một khối có chung metadata pair_id.
+    - câu hỏi chỉ có tiếng Việt => chỉ tìm trong các vector "vi" (mask lang, không quét vector Pali)
+    - trúng một dòng, dù là Pali hay Việt => trả về cả cặp [Pali] / [Việt] đã căn dòng
+"""
+import unicodedata
+from langchain_core.documents import Document
+from flat_index import FlatIndex
+from quote_index import PALI_CHARS
+
+# Dấu riêng của tiếng Việt (sau NFD): huyền, sắc, ngã, hỏi, nặng, trăng (ă), mũ (â ê ô), móc (ơ ư)
+_VI_MARKS = {"\u0300", "\u0301", "\u0303", "\u0309", "\u0323", "\u0306", "\u0302", "\u031b"}
+LANG_ORDER = {"pali": 0, "vi": 1}
+_SEGMENT_FIELDS = ("lang", "segment_part", "chunk_id", "token_count")
+
+def query_language(text):
+    """Trả về "vi" nếu câu hỏi là tiếng Việt thuần (có dấu tiếng Việt, không có chữ Pali), ngược lại
+    None (có chữ Pali, hoặc không dấu nên không phân biệt được => tìm cả hai ngôn ngữ)."""
+    lowered = text.lower()
+    if PALI_CHARS & set(lowered):
+        return None
+    if "đ" in lowered or _VI_MARKS & set(unicodedata.normalize("NFD", lowered)):
+        return "vi"
+    return None
+
+class BilingualIndex(FlatIndex):
+    def __init__(self, path, upcast=True):
+        super().__init__(path, upcast=upcast)
+        self.pairs = {}  # pair_id -> [hàng của các dòng Pali/Việt (và các phần nếu dòng bị tách)]
+        for i, metadata in enumerate(self.metadatas):
+            if metadata.get("pair_id"):
+                self.pairs.setdefault(metadata["pair_id"], []).append(i)
+
+    def search_by_vector(self, vector, k=5, filter=None, partition=None, lang=None):
+        """[(Document dòng đơn, cosine)]; `lang`: chỉ tìm trong các dòng của ngôn ngữ này."""
+        if lang:
+            filter = {"$and": [filter, {"lang": lang}]} if filter else {"lang": lang}
+        return super().search_by_vector(vector, k, filter, partition)
+
+    def pair_document(self, pair_id, matched_lang=None):
+        """Cả khối: header ngữ cảnh + dòng Pali + dòng Việt (đúng thứ tự trong file)."""
+        rows = sorted(self.pairs[pair_id], key=lambda i: (LANG_ORDER.get(self.metadatas[i].get("lang"), 2),
+                                                          self.metadatas[i].get("segment_part", 0)))
+        header, bodies = "", []
+        for i in rows:
+            header, _, body = self.document(i).page_content.partition("\n")
+            bodies.append(body)
+        metadata = {key: value for key, value in self.metadatas[rows[0]].items() if key not in _SEGMENT_FIELDS}
+        metadata["matched_lang"] = matched_lang
+        return Document(id=pair_id, page_content="\n".join([header] + bodies), metadata=metadata)
+
+    def to_pairs(self, docs):
+        """Đổi các dòng đơn thành cặp đã căn dòng, bỏ trùng (2 dòng cùng cặp), giữ thứ tự xếp hạng."""
+        pairs, seen = [], set()
+        for doc in docs:
+            pair_id = doc.metadata.get("pair_id")
+            if pair_id not in self.pairs:
+                pairs.append(doc)
+            elif pair_id not in seen:
+                seen.add(pair_id)
+                pairs.append(self.pair_document(pair_id, doc.metadata.get("lang")))
+        return pairs
+
+    def search_pairs(self, vector, k=5, filter=None, partition=None, lang=None):
+        """k cặp gần nhất; lấy dư 2k dòng vì hai dòng của một cặp có thể cùng trúng."""
+        hits = self.search_by_vector(vector, 2 * k, filter, partition, lang)
+        return self.to_pairs([doc for doc, _ in hits])[:k]
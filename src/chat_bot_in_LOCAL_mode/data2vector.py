@@ -1,28 +1,28 @@
 import os
+import sys
 import glob
-import torch # Uncomment if cuda debugging is needed
 from langchain_text_splitters import MarkdownHeaderTextSplitter, RecursiveCharacterTextSplitter
-from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_community.vectorstores import Chroma
 
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))) # Thư mục gốc repo: src.shared.*
+from stream_pipeline import batched, prefetch, embed_and_upsert
+from src.shared.embedding_cache import CachedEmbeddings
+from embedding_backend import load_embeddings, cache_model_name
+from src.shared.ingest_generation import bump_generation
+
 # --- CONFIGURATION ---
 DATA_FOLDER = "data/Truong_Bo_Kinh_Final"
 DB_PATH = "./chroma_db2"
 model_name = "intfloat/multilingual-e5-large-instruct"
+EMBED_BATCH_SIZE = 64 # Số chunk mỗi lần embed + upsert
+EMBED_CACHE_PATH = "./embedding_cache.sqlite3" # Cache vector dùng chung: chạy lại chỉ embed đoạn văn mới
 
-# Configuration for running on GPU 1050Ti
-model_kwargs = {'device': 'cuda'}
-encode_kwargs = {'normalize_embeddings': True} # E5 requires normalization for accurate cosine similarity calculation
+EMBEDDING_BACKEND = "torch" # fp32 trên GPU 1050Ti nếu có, không thì CPU (xem embedding_backend.py)
 
 print(f"Loading model {model_name}...")
-embedding_model = HuggingFaceEmbeddings(
-    model_name=model_name,
-    model_kwargs=model_kwargs,
-    encode_kwargs=encode_kwargs
-)
-# Check if GPU is detected (Optional)
-print(f"GPU Available: {torch.cuda.is_available()}") 
-print(f"GPU Name: {torch.cuda.get_device_name(0)}")
+embeddings, backend, _ = load_embeddings(model_name, EMBEDDING_BACKEND)
+embedding_model = CachedEmbeddings(embeddings, cache_model_name(model_name, backend), EMBED_CACHE_PATH)
 
 # 1. Splitter Configuration (Keep as is)
 headers_to_split_on = [
@@ -38,8 +38,7 @@ text_splitter = RecursiveCharacterTextSplitter(
 )
 # 3. Logical processing function
 def process_files():
-    all_final_chunks = []
-    
+    # Generator: trả chunk theo từng file thay vì gom hết vào một list
     # 1. Lấy danh sách file
     md_files = glob.glob(os.path.join(DATA_FOLDER, "*.md"))
     print(f"Tìm thấy {len(md_files)} file markdown.")
@@ -79,22 +78,16 @@ def process_files():
             # Metadata kỹ thuật (giữ nguyên)
             doc.metadata["source_file"] = os.path.basename(file_path)
             
-        all_final_chunks.extend(chunked_docs)
-
-    print(f"-> Tổng cộng đã tạo ra {len(all_final_chunks)} chunks dữ liệu.")
-    return all_final_chunks
+        yield from chunked_docs
 
 # 4. Main program execution
 if __name__ == "__main__":
     chunks = process_files() # You may need to redefine this function as above
-    
-    if chunks:
-        print("Initializing embedding model on GPU GTX 1050Ti...")
 
-        print("Vectorizing and saving to ChromaDB...")
-        db = Chroma.from_documents(
-            documents=chunks, 
-            embedding=embedding_model, 
-            persist_directory=DB_PATH
-        )
-        print("COMPLETED! 1050Ti processing finished.")
\ No newline at end of file
+    print("Vectorizing and saving to ChromaDB (streaming)...")
+    db = Chroma(persist_directory=DB_PATH, embedding_function=embedding_model)
+    # Thread nền tách batch kế tiếp trong lúc GPU embed batch hiện tại
+    total = embed_and_upsert(db, embedding_model, prefetch(batched(chunks, EMBED_BATCH_SIZE)))
+    print(f"-> Tổng cộng đã tạo ra {total} chunks dữ liệu.")
+    bump_generation(DB_PATH) # Báo cho các cache rằng dữ liệu đã đổi
+    print("COMPLETED!")
\ No newline at end of file
@@ -1,99 +1,169 @@
 import os
+import sys
 import glob
-import torch # Uncomment if cuda debugging is needed
-from langchain_text_splitters import MarkdownHeaderTextSplitter, RecursiveCharacterTextSplitter
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.vectorstores import Chroma
+import json
+import hashlib
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))) # Thư mục gốc repo: src.shared.*
+# Chỉ import nhẹ ở đây: tiến trình tách file (spawn) chạy lại phần đầu file này.
+# Chroma, torch/model, các chỉ mục... import trong __main__ / load_embedding_model.
+from scripture_splitter import split_files
 
 # --- CONFIGURATION ---
 DATA_FOLDER = "data/Truong_Bo_Kinh_Final"
+LIST_FILE_PATH = os.path.join(DATA_FOLDER, "list.md") # Tên kinh chuẩn (###) = khóa partition
 DB_PATH = "./chroma_db3"
+MANIFEST_PATH = os.path.join(DB_PATH, "manifest.json") # Lưu hash từng file + tham số chunking
+LEXICAL_INDEX_PATH = os.path.join(DB_PATH, "bm25") # Chỉ mục BM25 trên cùng các chunk (tìm kiếm lai)
+FLAT_INDEX_PATH = os.path.join(DB_PATH, "flat") # Ma trận vector float16 cho tìm kiếm chính xác bằng NumPy
+REDUCED_WIDTHS = () # Vd. (256, 512): tạo thêm bản PCA rút gọn flat_pca<width> (xem dim_reduction.py)
 model_name = "intfloat/multilingual-e5-large-instruct"
+EMBED_CACHE_PATH = "./embedding_cache.sqlite3" # Cache vector dùng chung: rebuild chỉ embed đoạn văn mới
 
-# Configuration for running on GPU 1050Ti
-model_kwargs = {'device': 'cuda'}
-encode_kwargs = {'normalize_embeddings': True} # E5 requires normalization for accurate cosine similarity calculation
-
-print(f"Loading model {model_name}...")
-embedding_model = HuggingFaceEmbeddings(
-    model_name=model_name,
-    model_kwargs=model_kwargs,
-    encode_kwargs=encode_kwargs
-)
-# Check if GPU is detected (Optional)
-print(f"GPU Available: {torch.cuda.is_available()}") 
-print(f"GPU Name: {torch.cuda.get_device_name(0)}")
-
-# 1. Splitter Configuration (Keep as is)
-headers_to_split_on = [
-    ("#", "Ten_bo_kinh"),
-    ("##", "Ten_pham"),
-    ("###", "Ten_bai_kinh"),
-]
-markdown_splitter = MarkdownHeaderTextSplitter(headers_to_split_on=headers_to_split_on)
-text_splitter = RecursiveCharacterTextSplitter(
-    separators=["\n\n", "\n", " ", ""], # Ưu tiên ngắt đoạn trước
-    chunk_size=1024, # Tăng lên vì E5-large support tới 512 tokens (~1500 chars), 512 là hơi ít cho song ngữ
-    chunk_overlap=100
-)
-# 3. Logical processing function
-def process_files():
-    all_final_chunks = []
-    md_files = glob.glob(os.path.join(DATA_FOLDER, "*.md"))
+# GPU 1050Ti nếu có, không thì CPU. Giữ "torch" (fp32) để vector trong DB là bản chuẩn;
+# "int8"/"onnx" nhanh hơn trên CPU nhưng chỉ xấp xỉ (xem embedding_backend.py)
+EMBEDDING_BACKEND = "torch"
+
+# Tham số chunking. Đổi bất kỳ giá trị nào ở đây => manifest không khớp => vector hóa lại toàn bộ
+MAX_TOKENS = 512 # Giới hạn của E5 (tính cả header ngữ cảnh + token đặc biệt), đo bằng tokenizer của model
+CHUNK_OVERLAP_TOKENS = 64
+EMBED_BATCH_SIZE = 64 # Số chunk tối đa mỗi lần embed + upsert (bộ nhớ tỉ lệ với số này, không với kích thước kho)
+EMBED_BATCH_TOKENS = 16384 # Tối đa số chunk x độ dài chunk dài nhất trong batch (= số token sau padding)
+PIPELINE_PARAMS = {
+    "model_name": model_name,
+    "max_tokens": MAX_TOKENS,
+    "chunk_overlap_tokens": CHUNK_OVERLAP_TOKENS,
+    "header_format": "Kinh: {ten_bai_kinh} ({ten_bo_kinh}).",
+    "splitter": "scripture-2", # Khối [Pali]/[Việt] nguyên vẹn, bỏ dòng "Source:" và dòng "[]"/"[x]" (xem scripture_splitter.py)
+    "index_mode": "combined", # Hoặc "bilingual": dòng Pali/Việt thành 2 vector riêng, nối bằng pair_id (app2 tự nhận ra qua flat/sidecar.json)
+}
+# Số tiến trình tách file. Tách cả Trường Bộ trong tiến trình này ~0.15s, còn khởi động mỗi tiến trình
+# spawn + tokenizer tốn cỡ 1s => 1 (không dùng pool) cho một bộ kinh; tăng lên 2-4 khi thêm nhiều bộ Nikāya
+SPLIT_WORKERS = 1
+
+def load_embedding_model(db):
+    # Chỉ load model khi thực sự có file cần vector hóa (tốn ~10s + VRAM)
+    from src.shared.embedding_cache import CachedEmbeddings
+    from embedding_backend import load_embeddings, cache_model_name, verify_against_store
+    print(f"Loading model {model_name}...")
+    embeddings, backend, device = load_embeddings(model_name, EMBEDDING_BACKEND)
+    # Backend xấp xỉ + collection đã có vector fp32 => kiểm tra trước khi trộn vector 2 loại
+    if backend != "torch":
+        ok, _, _ = verify_against_store(embeddings, db._collection)
+        if not ok:
+            sys.exit(f"❌ Backend {backend} lệch quá xa vector đã lưu trong {DB_PATH}. "
+                     f"Dùng EMBEDDING_BACKEND = 'torch' hoặc xóa {MANIFEST_PATH} để dựng lại toàn bộ.")
+    return CachedEmbeddings(embeddings, cache_model_name(model_name, backend), EMBED_CACHE_PATH)
 
-    for file_path in md_files:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-            
-        # 1. Tách metadata theo Header
-        md_docs = markdown_splitter.split_text(content)
-        
-        for doc in md_docs:
-            # 2. Xử lý Metadata chuẩn
-            ten_bo_kinh = doc.metadata.get("Ten_bo_kinh", "Unknown")
-            ten_pham = doc.metadata.get("Ten_pham", "")
-            ten_bai_kinh = doc.metadata.get("Ten_bai_kinh", "")
-            
-            # Cập nhật metadata chuẩn để Router dùng được
-            doc.metadata["Ten_bo_kinh"] = ten_bo_kinh
-            doc.metadata["Ten_bai_kinh"] = ten_bai_kinh
-            # Thêm một field chung để dễ search nếu cần
-            doc.metadata["search_key"] = f"{ten_bo_kinh} {ten_bai_kinh}"
-
-            # 3. CHUNKING CHIẾN LƯỢC: 
-            # Dùng separator ưu tiên \n\n để giữ nguyên đoạn văn
-            # Tăng chunk_size để bao trọn cả Pali và Việt (khoảng 1000-1500 chars)
-            splitter = RecursiveCharacterTextSplitter(
-                chunk_size=1200, 
-                chunk_overlap=200,
-                separators=["\n\n", "\n", "(?<=.)", " ", ""] # Regex lookbehind giữ dấu chấm
-            )
-            
-            sub_docs = splitter.split_documents([doc])
-            
-            for sub_doc in sub_docs:
-                # 4. CONTEXT ENRICHMENT
-                # Đưa thông tin kinh vào đầu nhưng ngắn gọn hơn
-                header_context = f"Kinh: {ten_bai_kinh} ({ten_bo_kinh})."
-                
-                # Format lại page_content: Context + Nội dung gốc
-                sub_doc.page_content = f"{header_context}\n{sub_doc.page_content}"
-                
-                all_final_chunks.append(sub_doc)
-
-    return all_final_chunks
+# 2. Manifest: biết file nào mới / đã sửa / đã xóa kể từ lần chạy trước
+def file_hash(file_path):
+    with open(file_path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def load_manifest():
+    if not os.path.exists(MANIFEST_PATH):
+        return None
+    with open(MANIFEST_PATH, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_manifest(file_hashes):
+    os.makedirs(DB_PATH, exist_ok=True)
+    with open(MANIFEST_PATH, 'w', encoding='utf-8') as f:
+        json.dump({"params": PIPELINE_PARAMS, "files": file_hashes}, f, ensure_ascii=False, indent=2)
+
+def chunk_id(file_name, index, content):
+    # ID cố định theo (file, vị trí, nội dung) => chạy lại chỉ ghi đè, không nhân bản
+    key = f"{file_name}|{index}|{hashlib.sha256(content.encode('utf-8')).hexdigest()}"
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]
+
+# 3. Logical processing function
+def process_files(md_files):
+    # Generator: trả chunk theo từng file (theo đúng thứ tự), không giữ toàn bộ kho trong bộ nhớ.
+    # Header, cặp [Pali]/[Việt] và chunk theo token được tách trong một lượt, song song nhiều tiến trình
+    from langchain_core.documents import Document
+    results = split_files(md_files, model_name, MAX_TOKENS, CHUNK_OVERLAP_TOKENS,
+                          PIPELINE_PARAMS["header_format"], workers=SPLIT_WORKERS,
+                          bilingual=PIPELINE_PARAMS["index_mode"] == "bilingual")
+    for file_name, file_chunks in results:
+        for i, (content, metadata, token_count) in enumerate(file_chunks):
+            metadata["token_count"] = token_count
+            metadata["chunk_id"] = chunk_id(file_name, i, content)
+            yield Document(page_content=content, metadata=metadata)
 
 # 4. Main program execution
 if __name__ == "__main__":
-    chunks = process_files() # You may need to redefine this function as above
-    
-    if chunks:
-        print("Initializing embedding model on GPU GTX 1050Ti...")
-
-        print("Vectorizing and saving to ChromaDB...")
-        db = Chroma.from_documents(
-            documents=chunks, 
-            embedding=embedding_model, 
-            persist_directory=DB_PATH
-        )
-        print("COMPLETED! 1050Ti processing finished.")
\ No newline at end of file
+    from langchain_community.vectorstores import Chroma
+    from stream_pipeline import prefetch, embed_and_upsert
+    from token_chunker import bucketed
+    from src.shared.lexical_index import LexicalIndex
+    from src.shared.ingest_generation import bump_generation
+    from flat_index import FlatIndex, export_collection, partition_key
+    from sutta_router import SuttaRouter
+    from quantized_index import QuantizedIndex, quantize_flat_index, MODES as QUANTIZED_MODES
+    from dim_reduction import ReducedIndex, reduce_flat_index, reduced_path
+
+    md_files = glob.glob(os.path.join(DATA_FOLDER, "*.md"))
+    current_hashes = {os.path.basename(p): file_hash(p) for p in md_files}
+    manifest = load_manifest()
+
+    db = Chroma(persist_directory=DB_PATH)
+
+    if manifest is None or manifest.get("params") != PIPELINE_PARAMS:
+        # Lần đầu có manifest, hoặc đổi model / tham số chunking => dựng lại toàn bộ
+        print("Manifest missing or pipeline params changed -> full rebuild.")
+        db.delete_collection()
+        db = Chroma(persist_directory=DB_PATH)
+        changed_files = sorted(current_hashes)
+        removed_files = []
+    else:
+        old_hashes = manifest["files"]
+        changed_files = sorted(f for f, h in current_hashes.items() if old_hashes.get(f) != h)
+        removed_files = sorted(f for f in old_hashes if f not in current_hashes)
+
+        # Xóa chunk của file đã sửa/đã xóa trước khi thêm bản mới
+        for file_name in changed_files + removed_files:
+            if file_name in old_hashes:
+                db._collection.delete(where={"source_file": file_name})
+
+    print(f"Changed/new files: {len(changed_files)} | Removed files: {len(removed_files)} | Unchanged: {len(current_hashes) - len(changed_files)}")
+
+    if changed_files:
+        embedding_model = load_embedding_model(db)
+
+        print("Vectorizing and saving to ChromaDB (streaming)...")
+        chunks = process_files([os.path.join(DATA_FOLDER, f) for f in changed_files])
+        # Thread nền tách batch kế tiếp trong lúc GPU embed batch hiện tại; batch gom chunk dài gần nhau
+        batches = bucketed(chunks, max_batch_tokens=EMBED_BATCH_TOKENS, max_batch_size=EMBED_BATCH_SIZE)
+        total = embed_and_upsert(db, embedding_model, prefetch(batches))
+        print(f"COMPLETED! {total} chunks.")
+    else:
+        print("Nothing to re-vectorize.")
+
+    # Các chỉ mục dẫn xuất phải khớp đúng các chunk trong Chroma => dựng lại khi có thay đổi,
+    # và dựng bản còn thiếu (lần đầu export, vừa thêm width vào REDUCED_WIDTHS...) kể cả khi dữ liệu không đổi
+    data_changed = bool(changed_files or removed_files)
+    rewritten = False
+    if data_changed or not LexicalIndex.exists(LEXICAL_INDEX_PATH):
+        LexicalIndex.build_from_chroma(db, LEXICAL_INDEX_PATH)
+        rewritten = True
+    flat_exported = data_changed or not FlatIndex.exists(FLAT_INDEX_PATH)
+    if flat_exported:
+        flat_index = export_collection(db, FLAT_INDEX_PATH) # Hàng xếp liền nhau theo kinh + partitions.json
+        if os.path.exists(LIST_FILE_PATH):
+            missing = [s.key for s in SuttaRouter(LIST_FILE_PATH).suttas if partition_key(s.key) not in flat_index.partitions]
+            if missing:
+                print(f"⚠️ {len(missing)} kinh trong list.md không có partition (Ten_bai_kinh không khớp): {missing}")
+    if flat_exported or not all(QuantizedIndex.exists(FLAT_INDEX_PATH, mode) for mode in QUANTIZED_MODES):
+        quantize_flat_index(FLAT_INDEX_PATH)
+        rewritten = True
+    for width in REDUCED_WIDTHS:
+        if flat_exported or not ReducedIndex.exists(reduced_path(FLAT_INDEX_PATH, width)):
+            reduce_flat_index(FLAT_INDEX_PATH, width)
+            rewritten = True
+    # Báo cho app (load lại chỉ mục) và các cache (câu trả lời, kết quả tìm kiếm) rằng dữ liệu đã đổi
+    if data_changed or rewritten:
+        bump_generation(DB_PATH)
+
+    # Chỉ ghi manifest khi mọi thứ đã lưu xong (chạy lỗi giữa chừng => lần sau làm lại các file đó)
+    save_manifest(current_hashes)
@@ -0,0 +1,140 @@
+"""
+Giảm số chiều vector (1024 -> 256/384/512) cho FlatIndex (xem flat_index.py):
+    pca        học phép chiếu PCA trên chính các vector chunk của kho (khuyên dùng)
+    truncate   giữ `width` chiều đầu kiểu Matryoshka (chỉ tốt nếu model được huấn luyện kiểu
+               Matryoshka; multilingual-e5-large-instruct thì không => xem benchmark trước khi dùng)
+Vector sau khi chiếu được chuẩn hóa lại => tích vô hướng vẫn là cosine.
+Câu hỏi phải đi qua cùng phép chiếu: ReducedIndex tự làm việc này trong search_by_vector.
+
+Thư mục kết quả (cạnh thư mục flat gốc, vd. chroma_db3/flat_pca256) có cùng định dạng FlatIndex
+cộng thêm projection.npz (method, mean, components).
+
+    python dim_reduction.py [flat_dir] [width ...]    # tạo các bản rút gọn + in benchmark
+"""
+import json
+import os
+import shutil
+import sys
+import time
+import numpy as np
+from flat_index import FlatIndex, _write_atomic
+
+METHODS = ("pca", "truncate")
+DEFAULT_WIDTHS = (256, 384, 512)
+
+def reduced_path(flat_path, width, method="pca"):
+    return f"{flat_path.rstrip(os.sep)}_{method}{width}"
+
+class Projection:
+    def __init__(self, method, mean, components):
+        self.method = method
+        self.mean = mean.astype(np.float32)              # (dim,); 0 với truncate
+        self.components = components.astype(np.float32)  # (width, dim)
+
+    @property
+    def width(self):
+        return len(self.components)
+
+    @classmethod
+    def fit(cls, vectors, width, method="pca"):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        dim = vectors.shape[1]
+        if not 0 < width <= dim:
+            raise ValueError(f"width phải trong khoảng 1..{dim}, nhận được {width}")
+        if method == "truncate":
+            return cls(method, np.zeros(dim), np.eye(dim, dtype=np.float32)[:width])
+        if method != "pca":
+            raise ValueError(f"method phải là một trong {METHODS}, nhận được {method!r}")
+        mean = vectors.mean(axis=0)
+        # SVD trên ma trận hiệp phương sai (dim x dim) thay vì trên (n x dim): nhanh khi n >> dim
+        covariance = np.cov(vectors - mean, rowvar=False)
+        _, eigenvectors = np.linalg.eigh(covariance)
+        return cls(method, mean, eigenvectors[:, ::-1][:, :width].T)
+
+    def apply(self, vectors):
+        """Chiếu (n, dim) hoặc (dim,) xuống `width` chiều và chuẩn hóa lại."""
+        projected = (np.asarray(vectors, dtype=np.float32) - self.mean) @ self.components.T
+        norms = np.linalg.norm(projected, axis=-1, keepdims=True)
+        return projected / np.where(norms == 0, 1, norms)
+
+    def save(self, path):
+        with open(path + ".tmp", "wb") as f:
+            np.savez(f, method=self.method, mean=self.mean, components=self.components)
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        return cls(str(data["method"]), data["mean"], data["components"])
+
+def reduce_flat_index(flat_path, width, method="pca", out_path=None):
+    """Tạo bản rút gọn của một FlatIndex; trả về ReducedIndex."""
+    out_path = out_path or reduced_path(flat_path, width, method)
+    source = FlatIndex(flat_path)
+    projection = Projection.fit(source.vectors, width, method)
+    os.makedirs(out_path, exist_ok=True)
+    _write_atomic(os.path.join(out_path, "vectors.f16"), projection.apply(source.vectors).astype(np.float16).tobytes())
+    shutil.copyfile(os.path.join(flat_path, "texts.bin"), os.path.join(out_path, "texts.bin"))
+    if os.path.exists(os.path.join(flat_path, "partitions.json")):
+        shutil.copyfile(os.path.join(flat_path, "partitions.json"), os.path.join(out_path, "partitions.json"))
+    with open(os.path.join(flat_path, "sidecar.json"), "r", encoding="utf-8") as f:
+        sidecar = json.load(f)
+    sidecar["dim"] = width
+    projection.save(os.path.join(out_path, "projection.npz"))
+    _write_atomic(os.path.join(out_path, "sidecar.json"), json.dumps(sidecar, ensure_ascii=False).encode("utf-8"))
+    print(f"✅ Reduced index ({method}): {len(source.ids)} vectors {source.vectors.shape[1]} -> {width} dim -> {out_path}")
+    return ReducedIndex(out_path)
+
+class ReducedIndex(FlatIndex):
+    """FlatIndex trên vector đã rút gọn; nhận vector câu hỏi đủ chiều và tự chiếu."""
+    def __init__(self, path, upcast=True):
+        super().__init__(path, upcast=upcast)
+        self.projection = Projection.load(os.path.join(path, "projection.npz"))
+
+    @staticmethod
+    def exists(path):
+        return FlatIndex.exists(path) and os.path.exists(os.path.join(path, "projection.npz"))
+
+    def search_by_vector(self, vector, k=5, filter=None, partition=None):
+        return super().search_by_vector(self.projection.apply(vector), k, filter, partition)
+
+def benchmark(flat_path, widths=DEFAULT_WIDTHS, methods=METHODS, k=10, n_queries=200, seed=0):
+    """In recall@k và độ trễ của từng bản rút gọn so với tìm kiếm đủ chiều.
+    Câu hỏi mẫu: vector của các chunk ngẫu nhiên (bỏ chính nó khỏi kết quả)."""
+    full = FlatIndex(flat_path)
+    n = len(full.ids)
+    if n <= k:
+        print(f"⚠️ Chỉ có {n} vector, không đủ để đo recall@{k}")
+        return
+    rng = np.random.default_rng(seed)
+    queries = rng.choice(n, size=min(n_queries, n), replace=False)
+
+    def top_ids(index, i):
+        hits = index.search_by_vector(full.vectors[i], k + 1)
+        return [doc.id for doc, _ in hits if doc.id != full.ids[i]][:k]
+
+    started = time.perf_counter()
+    truth = {i: set(top_ids(full, i)) for i in queries}
+    full_ms = (time.perf_counter() - started) / len(queries) * 1000
+    print(f"{'method':<10}{'width':>7}{'memory':>12}{'recall@' + str(k):>12}{'ms/query':>10}")
+    print(f"{'full':<10}{full.vectors.shape[1]:>7}{full.vectors.nbytes / 2**20:>10.1f}MB{1.0:>12.3f}{full_ms:>10.2f}")
+    for method in methods:
+        for width in widths:
+            path = reduced_path(flat_path, width, method)
+            if not ReducedIndex.exists(path):
+                print(f"{method:<10}{width:>7} (chưa có, chạy reduce_flat_index trước)")
+                continue
+            index = ReducedIndex(path)
+            started = time.perf_counter()
+            found = {i: top_ids(index, i) for i in queries}
+            ms = (time.perf_counter() - started) / len(queries) * 1000
+            recall = np.mean([len(truth[i] & set(found[i])) / len(truth[i]) for i in queries])
+            print(f"{method:<10}{width:>7}{index.vectors.nbytes / 2**20:>10.1f}MB{recall:>12.3f}{ms:>10.2f}")
+
+if __name__ == "__main__":
+    flat_path = sys.argv[1] if len(sys.argv) > 1 else "./chroma_db3/flat"
+    widths = [int(w) for w in sys.argv[2:]] or list(DEFAULT_WIDTHS)
+    for method in METHODS:
+        for width in widths:
+            reduce_flat_index(flat_path, width, method)
+    benchmark(flat_path, widths)
@@ -0,0 +1,114 @@
+"""
+Backend embedding có thể thay thế cho multilingual-e5-large-instruct:
+    torch   fp32 của sentence-transformers (GPU nếu có, không thì CPU)
+    int8    fp32 + torch dynamic quantization (nn.Linear -> int8), chỉ chạy trên CPU, ~2-3x nhanh hơn
+    onnx    ONNX Runtime qua sentence-transformers (backend="onnx", cần `optimum[onnxruntime]`)
+    auto    torch trên GPU nếu có; không có GPU => int8
+Vector của backend nhanh chỉ xấp xỉ vector fp32 đã lưu trong DB: verify_against_store() embed lại
+một mẫu chunk và so cosine với vector đã lưu trước khi dùng chung một collection.
+
+    python embedding_backend.py [db_dir] [backend ...]    # so sánh các backend với vector trong DB
+"""
+import os
+import sys
+import time
+import numpy as np
+import torch
+from langchain_huggingface import HuggingFaceEmbeddings
+
+BACKENDS = ("torch", "int8", "onnx")
+COSINE_TOLERANCE = 0.99 # Cosine tối thiểu (trung bình mẫu) giữa vector mới và vector fp32 đã lưu
+_threads_tuned = False
+
+def pick_device(device=None):
+    """`device` nếu được chỉ định, không thì cuda khi có GPU, ngược lại cpu."""
+    if device:
+        return device
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+def tune_threads(num_threads=None):
+    """Số thread PyTorch = số CPU được phép dùng (cgroup/affinity), chỉ đặt một lần mỗi tiến trình."""
+    global _threads_tuned
+    if num_threads is None:
+        num_threads = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+    torch.set_num_threads(num_threads)
+    if not _threads_tuned:
+        try:
+            torch.set_num_interop_threads(1)  # một câu hỏi/batch tại một thời điểm: song song trong op là đủ
+        except RuntimeError:
+            pass  # chỉ đặt được trước khi PyTorch chạy op đầu tiên
+        _threads_tuned = True
+    return num_threads
+
+def resolve_backend(backend="auto", device=None):
+    """(backend, device) thực sự dùng; backend CPU-only trên máy có GPU vẫn chạy CPU."""
+    device = pick_device(device)
+    if backend == "auto":
+        backend = "torch" if device != "cpu" else "int8"
+    if backend not in BACKENDS:
+        raise ValueError(f"backend phải là 'auto' hoặc một trong {BACKENDS}, nhận được {backend!r}")
+    if backend in ("int8", "onnx"):
+        device = "cpu"
+    return backend, device
+
+def cache_model_name(model_name, backend):
+    """Tên model dùng làm khóa CachedEmbeddings: vector int8/onnx không trộn với vector fp32."""
+    return model_name if backend == "torch" else f"{model_name}@{backend}"
+
+def load_embeddings(model_name, backend="auto", device=None):
+    """HuggingFaceEmbeddings (chuẩn hóa L2) cho backend đã chọn. Trả về (embeddings, backend, device)."""
+    backend, device = resolve_backend(backend, device)
+    if device == "cpu":
+        tune_threads()
+    model_kwargs = {"device": device}
+    if backend == "onnx":
+        model_kwargs["backend"] = "onnx"
+    embeddings = HuggingFaceEmbeddings(
+        model_name=model_name,
+        model_kwargs=model_kwargs,
+        encode_kwargs={"normalize_embeddings": True},
+    )
+    if backend == "int8":
+        torch.quantization.quantize_dynamic(embeddings._client, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    print(f"🧠 Embedding backend: {backend} ({device}, {torch.get_num_threads()} threads)")
+    return embeddings, backend, device
+
+def verify_against_store(embeddings, collection, sample=16, tolerance=COSINE_TOLERANCE, seed=0):
+    """Embed lại `sample` chunk của một collection Chroma, so cosine với vector đã lưu.
+    Trả về (đạt?, cosine trung bình, cosine nhỏ nhất). Collection rỗng => coi như đạt."""
+    count = collection.count()
+    if not count:
+        return True, 1.0, 1.0
+    offsets = np.random.default_rng(seed).choice(count, size=min(sample, count), replace=False)
+    texts, stored = [], []
+    for offset in offsets:
+        page = collection.get(include=["embeddings", "documents"], limit=1, offset=int(offset))
+        if page["ids"] and page["documents"][0]:
+            texts.append(page["documents"][0])
+            stored.append(page["embeddings"][0])
+    if not texts:
+        return True, 1.0, 1.0
+    fresh = np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+    stored = np.asarray(stored, dtype=np.float32)
+    fresh /= np.linalg.norm(fresh, axis=1, keepdims=True)
+    stored /= np.linalg.norm(stored, axis=1, keepdims=True)
+    cosines = (fresh * stored).sum(axis=1)
+    ok = float(cosines.mean()) >= tolerance
+    mark = "✅" if ok else "⚠️"
+    print(f"{mark} Cosine với vector đã lưu ({len(texts)} chunk): trung bình {cosines.mean():.4f}, "
+          f"nhỏ nhất {cosines.min():.4f} (ngưỡng {tolerance})")
+    return ok, float(cosines.mean()), float(cosines.min())
+
+if __name__ == "__main__":
+    import chromadb
+    db_path = sys.argv[1] if len(sys.argv) > 1 else "./chroma_db3"
+    backends = sys.argv[2:] or list(BACKENDS)
+    collection = chromadb.PersistentClient(path=db_path).get_collection("langchain")  # tên mặc định của langchain Chroma
+    query = "Instruct: Given a web search query, retrieve relevant passages that answer the query\nQuery: Kinh Phạm Võng"
+    for name in backends:
+        embeddings, _, _ = load_embeddings("intfloat/multilingual-e5-large-instruct", name)
+        embeddings.embed_query(query)  # warm-up
+        started = time.perf_counter()
+        embeddings.embed_query(query)
+        print(f"   1 câu hỏi: {(time.perf_counter() - started) * 1000:.0f} ms")
+        verify_against_store(embeddings, collection)
@@ -0,0 +1,222 @@
+"""
+Tìm kiếm chính xác (exact top-k) bằng NumPy trên ma trận vector float16 được memory-map.
+Bộ Trường Bộ chỉ có vài nghìn vector 1024 chiều: một phép nhân ma trận-vector là đủ,
+không cần SQLite + HNSW của Chroma.
+
+Xuất từ một collection Chroma ra thư mục `path`:
+    vectors.f16     ma trận (n, dim) float16, đã chuẩn hóa => tích vô hướng = cosine
+    texts.bin       nội dung các chunk (UTF-8) nối liền, đọc theo offset khi cần
+    sidecar.json    dim, ids, metadata, offset nội dung, index_mode ("combined" / "bilingual")
+    partitions.json Ten_bai_kinh -> [hàng đầu, hàng cuối): các hàng được xếp liền nhau theo kinh,
+                    nên tìm trong một kinh chỉ nhân ma trận trên đúng đoạn hàng của kinh đó
+                    (độ trễ không tăng khi thêm các bộ Nikāya khác vào cùng DB)
+"""
+import json
+import mmap
+import os
+import sys
+import numpy as np
+from langchain_core.documents import Document
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))) # Chạy trực tiếp (kể cả quantized_index/dim_reduction): src.shared.*
+from src.shared.embedding_cache import normalize_text
+
+PARTITION_FIELD = "Ten_bai_kinh" # Khóa = tên kinh (cột ### trong list.md), giống giá trị Router trả về
+
+def _write_atomic(path, data):
+    with open(path + ".tmp", "wb") as f:
+        f.write(data)
+    os.replace(path + ".tmp", path)
+
+def _index_mode(sidecar):
+    """Chế độ ingest của index: ghi trong sidecar, hoặc (bản export cũ) suy ra từ metadata pair_id."""
+    if sidecar.get("index_mode"):
+        return sidecar["index_mode"]
+    return "bilingual" if any(m.get("pair_id") for m in sidecar["metadatas"]) else "combined"
+
+def read_index_mode(path):
+    """Chế độ ingest ("combined" / "bilingual") của index flat ở `path`, không load vector."""
+    with open(os.path.join(path, "sidecar.json"), "r", encoding="utf-8") as f:
+        return _index_mode(json.load(f))
+
+def partition_key(name):
+    """Tên kinh đã chuẩn hóa (NFC, chữ thường, gộp khoảng trắng) để tra partition."""
+    return normalize_text(name or "").casefold()
+
+def export_collection(db, path, page_size=1000, partition_field=PARTITION_FIELD):
+    """Ghi toàn bộ vector + nội dung + metadata của một langchain Chroma ra định dạng phẳng,
+    các hàng được nhóm liền nhau theo `partition_field`."""
+    collection = db._collection
+    count = collection.count()
+    os.makedirs(path, exist_ok=True)
+    ids, metadatas, documents = [], [], []
+    vectors = None
+    offset = 0
+    while offset < count:
+        page = collection.get(include=["embeddings", "documents", "metadatas"], limit=page_size, offset=offset)
+        if not page["ids"]:
+            break
+        block = np.asarray(page["embeddings"], dtype=np.float32)
+        if vectors is None:
+            vectors = np.lib.format.open_memmap(path + "/vectors.tmp.npy", mode="w+", dtype=np.float16,
+                                                shape=(count, block.shape[1]))
+        norms = np.linalg.norm(block, axis=1, keepdims=True)
+        vectors[offset:offset + len(block)] = block / np.where(norms == 0, 1, norms)
+        for chunk_id, text, meta in zip(page["ids"], page["documents"], page["metadatas"]):
+            ids.append(chunk_id)
+            metadatas.append(meta or {})
+            documents.append(text or "")
+        offset += len(page["ids"])
+
+    # Xếp hàng theo kinh (ổn định: giữ thứ tự gốc trong từng kinh) và ghi lại ranh giới
+    keys = [partition_key(m.get(partition_field)) for m in metadatas]
+    order = sorted(range(len(ids)), key=keys.__getitem__)
+    partitions = {}
+    for row, i in enumerate(order):
+        start, _ = partitions.get(keys[i], (row, row))
+        partitions[keys[i]] = (start, row + 1)
+    ids = [ids[i] for i in order]
+    metadatas = [metadatas[i] for i in order]
+    texts, offsets = bytearray(), [0]
+    for i in order:
+        texts += documents[i].encode("utf-8")
+        offsets.append(len(texts))
+
+    dim = vectors.shape[1] if vectors is not None else 0
+    if vectors is not None:
+        vectors.flush()
+        # Bỏ header .npy: file chỉ gồm dữ liệu thô (đã xếp theo kinh), sidecar mô tả shape
+        raw = np.load(path + "/vectors.tmp.npy", mmap_mode="r")[:len(ids)]
+        with open(os.path.join(path, "vectors.f16.tmp"), "wb") as f:
+            for start, end in partitions.values():
+                f.write(raw[order[start:end]].tobytes())
+        os.replace(os.path.join(path, "vectors.f16.tmp"), os.path.join(path, "vectors.f16"))
+        del raw, vectors
+        os.remove(path + "/vectors.tmp.npy")
+    else:
+        _write_atomic(os.path.join(path, "vectors.f16"), b"")
+    _write_atomic(os.path.join(path, "texts.bin"), bytes(texts))
+    sidecar = {"dim": dim, "ids": ids, "metadatas": metadatas, "offsets": offsets}
+    sidecar["index_mode"] = _index_mode(sidecar)  # app chọn BilingualIndex theo giá trị này
+    _write_atomic(os.path.join(path, "sidecar.json"), json.dumps(sidecar, ensure_ascii=False).encode("utf-8"))
+    partition_file = {"field": partition_field, "partitions": partitions}
+    _write_atomic(os.path.join(path, "partitions.json"), json.dumps(partition_file, ensure_ascii=False).encode("utf-8"))
+    print(f"✅ Flat index: {len(ids)} vectors x {dim} dim (float16), {len(partitions)} partitions -> {path}")
+    return FlatIndex(path)
+
+class FlatIndex:
+    def __init__(self, path, upcast=True):
+        """`upcast=True`: chép ma trận sang float32 trong RAM một lần (vài ms, ~16MB cho 4000x1024)
+        để phép nhân dùng BLAS; `False`: tính thẳng trên memmap float16 (bộ lớn, RAM ít)."""
+        self.path = path
+        with open(os.path.join(path, "sidecar.json"), "r", encoding="utf-8") as f:
+            sidecar = json.load(f)
+        self.ids = sidecar["ids"]
+        self.metadatas = sidecar["metadatas"]
+        self.offsets = sidecar["offsets"]
+        self.index_mode = _index_mode(sidecar)
+        n, dim = len(self.ids), sidecar["dim"]
+        if n:
+            self.vectors = np.memmap(os.path.join(path, "vectors.f16"), dtype=np.float16, mode="r", shape=(n, dim))
+            if upcast:
+                self.vectors = np.asarray(self.vectors, dtype=np.float32)
+        else:
+            self.vectors = np.zeros((0, dim), dtype=np.float32)
+        with open(os.path.join(path, "texts.bin"), "rb") as f:
+            self.texts = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b""
+        self._masks = {}
+        self.partition_field, self.partitions = None, {}
+        partition_path = os.path.join(path, "partitions.json")
+        if os.path.exists(partition_path):
+            with open(partition_path, "r", encoding="utf-8") as f:
+                partition_file = json.load(f)
+            self.partition_field = partition_file["field"]
+            self.partitions = {key: tuple(rows) for key, rows in partition_file["partitions"].items()}
+
+    @staticmethod
+    def exists(path):
+        return os.path.exists(os.path.join(path, "sidecar.json"))
+
+    def _field_mask(self, field, value):
+        key = (field, value)
+        if key not in self._masks:
+            self._masks[key] = np.fromiter((m.get(field) == value for m in self.metadatas), dtype=bool, count=len(self.ids))
+        return self._masks[key]
+
+    def rows(self, partition=None):
+        """slice các hàng của một kinh (tên kinh bất kỳ cách viết hoa/dấu cách); partition None = mọi hàng.
+        Trả về None nếu tên không có partition (index cũ không có partitions.json, tên khớp Ten_bo_kinh,
+        tiêu đề file lệch list.md...) => gọi hàm lọc bằng mask metadata thay thế, không trả về rỗng."""
+        if partition is None:
+            return slice(0, len(self.ids))
+        rows = self.partitions.get(partition_key(partition))
+        return slice(*rows) if rows else None
+
+    def _scope(self, filter, partition):
+        """(slice hàng cần quét, mask trên đoạn hàng đó hoặc None)."""
+        rows = self.rows(partition)
+        if rows is None:  # chưa có partition: quay về lọc theo metadata trên toàn bộ
+            part = {PARTITION_FIELD: partition}
+            filter = {"$and": [filter, part]} if filter else part
+            rows = slice(0, len(self.ids))
+        mask = self.mask(filter)
+        return rows, (mask[rows] if mask is not None else None)
+
+    def mask(self, where):
+        """Mảng bool theo filter kiểu Chroma (so sánh bằng, $and, $or, $eq, $in); None = không lọc.
+        Không được sửa mảng trả về (có thể là mask đã cache)."""
+        if not where:
+            return None
+        if len(where) == 1:
+            (key, cond), = where.items()
+            if not key.startswith("$") and not isinstance(cond, dict):
+                return self._field_mask(key, cond)  # trường hợp hay gặp nhất: không cấp phát mảng mới
+        result = np.ones(len(self.ids), dtype=bool)
+        for key, cond in where.items():
+            if key == "$or":
+                part = np.zeros(len(self.ids), dtype=bool)
+                for sub in cond:
+                    part |= self.mask(sub)
+            elif key == "$and":
+                part = np.ones(len(self.ids), dtype=bool)
+                for sub in cond:
+                    part &= self.mask(sub)
+            elif isinstance(cond, dict) and "$in" in cond:
+                part = np.zeros(len(self.ids), dtype=bool)
+                for value in cond["$in"]:
+                    part |= self._field_mask(key, value)
+            elif isinstance(cond, dict) and "$eq" in cond:
+                part = self._field_mask(key, cond["$eq"])
+            else:
+                part = self._field_mask(key, cond)
+            result &= part
+        return result
+
+    def document(self, i):
+        text = self.texts[self.offsets[i]:self.offsets[i + 1]].decode("utf-8")
+        return Document(id=self.ids[i], page_content=text, metadata=dict(self.metadatas[i]))
+
+    def search_by_vector(self, vector, k=5, filter=None, partition=None):
+        """[(Document, cosine)] của k vector gần nhất (chính xác, không xấp xỉ).
+        `partition`: tên kinh => chỉ nhân ma trận trên các hàng của kinh đó."""
+        if not len(self.ids):
+            return []
+        rows, mask = self._scope(filter, partition)
+        query = np.asarray(vector, dtype=self.vectors.dtype)
+        scores = (self.vectors[rows] @ query).astype(np.float32)
+        scores /= np.linalg.norm(np.asarray(vector, dtype=np.float32)) or 1.0
+        if mask is not None:
+            scores[~mask] = -np.inf
+            k = min(k, int(mask.sum()))
+        k = min(k, len(scores))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.document(rows.start + int(i)), float(scores[i])) for i in top]
+
+if __name__ == "__main__":
+    # python flat_index.py [chroma_dir] [flat_dir]
+    from langchain_chroma import Chroma
+    db_path = sys.argv[1] if len(sys.argv) > 1 else "./chroma_db3"
+    flat_path = sys.argv[2] if len(sys.argv) > 2 else os.path.join(db_path, "flat")
+    export_collection(Chroma(persist_directory=db_path), flat_path)
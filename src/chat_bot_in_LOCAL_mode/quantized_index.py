@@ -0,0 +1,148 @@
+"""
+Chỉ mục vector lượng tử hóa trên FlatIndex (xem flat_index.py), để RAM không tăng tuyến tính
+4KB/chunk khi thêm các bộ Nikāya khác:
+    int8     1 byte/chiều  (x4 nhỏ hơn float32), scale đối xứng theo từng chiều
+    binary   1 bit/chiều   (x32 nhỏ hơn), chỉ giữ dấu; lọc sơ bộ bằng khoảng cách Hamming
+Cả hai chỉ dùng để chọn `rescore * k` ứng viên; điểm cuối cùng tính lại bằng vector gốc
+float16 đọc từ memmap (chỉ vài chục hàng mỗi câu hỏi => không cần nạp cả ma trận vào RAM).
+
+File thêm vào thư mục flat:
+    int8.npy, int8_scale.npy    mã int8 (n, dim) + scale (dim,)
+    binary.npy                  bit dấu đã pack (n, dim/8) uint8
+
+Báo cáo recall/bộ nhớ so với tìm kiếm chính xác:  python quantized_index.py ./chroma_db3/flat
+"""
+import os
+import sys
+import time
+import numpy as np
+from flat_index import FlatIndex
+
+MODES = ("int8", "binary")
+BLOCK_ROWS = 8192 # Số hàng int8 đổi sang float32 mỗi lần khi chấm điểm (giới hạn bộ nhớ tạm)
+
+if hasattr(np, "bitwise_count"):  # NumPy >= 2.0
+    def _popcount(a):
+        return np.bitwise_count(a)
+else:
+    _POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+    def _popcount(a):
+        return _POPCOUNT[a]
+
+def _save_atomic(path, array):
+    with open(path + ".tmp", "wb") as f:
+        np.save(f, array)
+    os.replace(path + ".tmp", path)
+
+def quantize_flat_index(path, modes=MODES):
+    """Tạo mã int8 / binary từ vectors.f16 của một FlatIndex (chạy lại sau mỗi lần export)."""
+    flat = FlatIndex(path, upcast=False)
+    vectors = np.asarray(flat.vectors, dtype=np.float32)
+    if "int8" in modes:
+        scale = np.abs(vectors).max(axis=0) / 127 if len(vectors) else np.ones(vectors.shape[1], np.float32)
+        scale = np.where(scale == 0, 1, scale).astype(np.float32)
+        codes = np.clip(np.rint(vectors / scale), -127, 127).astype(np.int8)
+        _save_atomic(os.path.join(path, "int8_scale.npy"), scale)
+        _save_atomic(os.path.join(path, "int8.npy"), codes)
+    if "binary" in modes:
+        _save_atomic(os.path.join(path, "binary.npy"), np.packbits(vectors > 0, axis=1))
+    print(f"✅ Quantized index ({', '.join(modes)}): {len(vectors)} vectors -> {path}")
+
+class QuantizedIndex(FlatIndex):
+    def __init__(self, path, mode="int8", rescore=4):
+        """`rescore`: số ứng viên đưa sang bước chấm lại bằng vector gốc = rescore * k."""
+        if mode not in MODES:
+            raise ValueError(f"mode phải là một trong {MODES}, nhận được {mode!r}")
+        super().__init__(path, upcast=False)  # self.vectors: memmap float16, chỉ đọc khi chấm lại
+        self.mode = mode
+        self.rescore = rescore
+        if mode == "int8":
+            self.codes = np.load(os.path.join(path, "int8.npy"), mmap_mode="r")
+            self.scale = np.load(os.path.join(path, "int8_scale.npy"))
+        else:
+            self.codes = np.load(os.path.join(path, "binary.npy"), mmap_mode="r")
+        self.codes = np.ascontiguousarray(self.codes)  # mã nhỏ: giữ trong RAM
+
+    @staticmethod
+    def exists(path, mode="int8"):
+        return FlatIndex.exists(path) and os.path.exists(os.path.join(path, f"{mode}.npy"))
+
+    @property
+    def memory_bytes(self):
+        return self.codes.nbytes
+
+    def _approximate_scores(self, query, rows):
+        """Điểm xấp xỉ (càng lớn càng gần) cho các hàng trong slice `rows`."""
+        codes = self.codes[rows]
+        if self.mode == "binary":
+            bits = np.packbits(query > 0)
+            return -_popcount(codes ^ bits).sum(axis=1, dtype=np.int32).astype(np.float32)
+        scaled = query * self.scale
+        scores = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), BLOCK_ROWS):
+            block = codes[start:start + BLOCK_ROWS]
+            scores[start:start + len(block)] = block.astype(np.float32) @ scaled
+        return scores
+
+    def search_by_vector(self, vector, k=5, filter=None, partition=None):
+        """[(Document, cosine)]: lọc sơ bộ bằng mã lượng tử hóa, chấm lại bằng vector float16 gốc.
+        `partition`: tên kinh => chỉ quét các hàng của kinh đó."""
+        if not len(self.ids):
+            return []
+        rows, mask = self._scope(filter, partition)
+        query = np.asarray(vector, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        scores = self._approximate_scores(query, rows)
+        if mask is not None:
+            scores[~mask] = -np.inf
+            k = min(k, int(mask.sum()))
+        k = min(k, len(scores))
+        if k <= 0:
+            return []
+        n_candidates = min(len(scores), max(k, self.rescore * k))
+        if mask is not None:
+            n_candidates = min(n_candidates, int(mask.sum()))
+        candidates = np.argpartition(-scores, n_candidates - 1)[:n_candidates] + rows.start
+        candidates.sort()  # đọc memmap theo thứ tự tăng dần
+        exact = np.asarray(self.vectors[candidates], dtype=np.float32) @ query
+        order = np.argsort(-exact)[:k]
+        return [(self.document(int(candidates[i])), float(exact[i])) for i in order]
+
+def recall_report(path, k=10, n_queries=200, rescore_factors=(1, 2, 4, 10), seed=0):
+    """In recall@k, bộ nhớ và độ trễ của từng chế độ so với tìm kiếm chính xác float32.
+    Câu hỏi mẫu: vector của các chunk ngẫu nhiên (bỏ chính nó khỏi kết quả)."""
+    exact_index = FlatIndex(path)
+    n = len(exact_index.ids)
+    if n <= k:
+        print(f"⚠️ Chỉ có {n} vector, không đủ để đo recall@{k}")
+        return
+    rng = np.random.default_rng(seed)
+    queries = rng.choice(n, size=min(n_queries, n), replace=False)
+
+    def top_ids(index, i):
+        hits = index.search_by_vector(exact_index.vectors[i], k + 1)
+        return [doc.id for doc, _ in hits if doc.id != exact_index.ids[i]][:k]
+
+    started = time.perf_counter()
+    truth = {i: set(top_ids(exact_index, i)) for i in queries}
+    exact_ms = (time.perf_counter() - started) / len(queries) * 1000
+    print(f"{'mode':<8}{'rescore':>8}{'memory':>12}{'recall@' + str(k):>12}{'ms/query':>10}")
+    print(f"{'float32':<8}{'-':>8}{exact_index.vectors.nbytes / 2**20:>10.1f}MB{1.0:>12.3f}{exact_ms:>10.2f}")
+    for mode in MODES:
+        if not QuantizedIndex.exists(path, mode):
+            print(f"{mode:<8} (chưa có, chạy quantize_flat_index trước)")
+            continue
+        for factor in rescore_factors:
+            index = QuantizedIndex(path, mode=mode, rescore=factor)
+            started = time.perf_counter()
+            found = {i: top_ids(index, i) for i in queries}
+            ms = (time.perf_counter() - started) / len(queries) * 1000
+            recall = np.mean([len(truth[i] & set(found[i])) / len(truth[i]) for i in queries])
+            print(f"{mode:<8}{factor:>8}{index.memory_bytes / 2**20:>10.1f}MB{recall:>12.3f}{ms:>10.2f}")
+
+if __name__ == "__main__":
+    # python quantized_index.py [flat_dir]   (mặc định ./chroma_db3/flat, tạo mã nếu chưa có)
+    flat_path = sys.argv[1] if len(sys.argv) > 1 else "./chroma_db3/flat"
+    if not all(QuantizedIndex.exists(flat_path, mode) for mode in MODES):
+        quantize_flat_index(flat_path)
+    recall_report(flat_path)
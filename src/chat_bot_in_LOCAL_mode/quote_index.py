@@ -0,0 +1,122 @@
+"""
+Tra cứu trích dẫn nguyên văn (Pali / Việt): "Evaṃ me sutaṃ – ekaṃ samayaṃ…" -> kinh nào, đoạn nào.
+
+Mỗi đoạn văn (tách theo dòng trống) được chuẩn hóa thành chuỗi từ (chữ thường, NFC, bỏ dấu câu)
+và index theo bộ 3 từ liên tiếp (word 3-gram). Khi tra: lấy các 3-gram hiếm nhất của câu trích
+để ra vài đoạn ứng viên, rồi kiểm tra chuỗi con chính xác => không bỏ sót, không khớp nhầm.
+"""
+import json
+import os
+import re
+import unicodedata
+from array import array
+
+GRAM = 3
+PALI_CHARS = set("āīūṃṅñṭḍṇḷ")
+_QUESTION_WORDS = re.compile(r"\b(gì|sao|nào|ai|không|chăng|hãy|giải thích|là gì|what|why|how)\b", re.IGNORECASE)
+_ELLIPSIS = re.compile(r"…|\.\.\.+")
+
+def words_of(text):
+    return re.findall(r"\w+", unicodedata.normalize("NFC", text.lower()))
+
+def looks_like_quote(text):
+    """Câu người dùng giống một đoạn trích (dán nguyên văn) hơn là một câu hỏi?"""
+    stripped = text.strip()
+    words = words_of(stripped)
+    if len(words) < GRAM:
+        return False
+    if re.match(r'^["“„\'].+["”\']$', stripped, re.DOTALL):
+        return True
+    if "?" in stripped:
+        return False
+    if PALI_CHARS & set(stripped.lower()) and len(words) >= 4:
+        return True
+    return len(words) >= 12 and not _QUESTION_WORDS.search(stripped)
+
+class Occurrence:
+    def __init__(self, source, corpus, header_path, paragraph, text):
+        self.source = source            # Tên file .md
+        self.corpus = corpus            # "final" (Truong_Bo_Kinh_Final) hoặc "leann" (passages.jsonl)
+        self.header_path = header_path  # "Trường Bộ kinh(...) > Phẩm ... > Kinh ..."
+        self.paragraph = paragraph      # Số thứ tự đoạn trong file (từ 1)
+        self.text = text
+
+    def __repr__(self):
+        return f"Occurrence({self.source!r}, {self.header_path!r}, ¶{self.paragraph})"
+
+class QuoteIndex:
+    def __init__(self):
+        self.paragraphs = []   # (source, corpus, header_path, number, raw text)
+        self.joined = []       # " từ1 từ2 ... " của từng đoạn (có khoảng trắng 2 đầu)
+        self.grams = {}        # (từ, từ, từ) -> array("I") id đoạn
+
+    def add_document(self, text, source, corpus):
+        headers = {}
+        number = 0
+        for block in re.split(r"\n\s*\n", text):
+            block = block.strip()
+            if not block:
+                continue
+            # Một block có thể chứa cả dòng header lẫn nội dung (vd. "### Kinh ...\n[1. Evaṃ...")
+            body = []
+            for line in block.split("\n"):
+                match = re.match(r"^(#{1,3})\s+(.*)", line)
+                if match:
+                    level = len(match.group(1))
+                    headers = {k: v for k, v in headers.items() if k < level}
+                    headers[level] = match.group(2).strip()
+                elif not line.startswith("Source:"):
+                    body.append(line)
+            body = "\n".join(body).strip()
+            if not body:
+                continue
+            number += 1
+            self._add_paragraph(source, corpus, " > ".join(headers[k] for k in sorted(headers)), number, body)
+
+    def _add_paragraph(self, source, corpus, header_path, number, text):
+        para_id = len(self.paragraphs)
+        words = words_of(text)
+        self.paragraphs.append((source, corpus, header_path, number, text))
+        self.joined.append(f" {' '.join(words)} ")
+        for gram in set(zip(*(words[i:] for i in range(GRAM)))):
+            self.grams.setdefault(gram, array("I")).append(para_id)
+
+    @classmethod
+    def build(cls, final_dir, leann_passages=None):
+        index = cls()
+        for name in sorted(os.listdir(final_dir)):
+            if name.endswith(".md") and name != "list.md":
+                with open(os.path.join(final_dir, name), "r", encoding="utf-8") as f:
+                    index.add_document(f.read(), name, "final")
+        if leann_passages and os.path.exists(leann_passages):
+            with open(leann_passages, "r", encoding="utf-8") as f:
+                for line in f:
+                    passage = json.loads(line)
+                    source = (passage.get("metadata") or {}).get("source") or f"leann:{passage['id']}"
+                    index.add_document(passage["text"], os.path.basename(source), "leann")
+        print(f"✅ Quote index: {len(index.paragraphs)} paragraphs, {len(index.grams)} 3-grams.")
+        return index
+
+    def find(self, quote):
+        """Mọi đoạn chứa nguyên văn `quote`. Dấu "…" chia câu trích thành nhiều phần,
+        mỗi phần (>= 3 từ) phải có mặt trong cùng một đoạn."""
+        segments = [words_of(s) for s in _ELLIPSIS.split(quote)]
+        segments = [s for s in segments if len(s) >= GRAM]
+        if not segments:
+            return []
+
+        candidates = None
+        for words in segments:
+            grams = list(zip(*(words[i:] for i in range(GRAM))))
+            postings = [self.grams.get(g) for g in grams]
+            if any(p is None for p in postings):
+                return []  # có một 3-gram không xuất hiện ở đâu => không thể khớp
+            # 2 bộ hiếm nhất đã đủ thu hẹp còn vài đoạn
+            for p in sorted(postings, key=len)[:2]:
+                candidates = set(p) if candidates is None else candidates & set(p)
+            if not candidates:
+                return []
+
+        needles = [f" {' '.join(words)} " for words in segments]
+        hits = [i for i in sorted(candidates) if all(n in self.joined[i] for n in needles)]
+        return [Occurrence(*self.paragraphs[i]) for i in hits]
@@ -0,0 +1,35 @@
+"""
+Xếp hạng lại các chunk bằng cross-encoder nhỏ, đa ngữ, chạy được trên CPU.
+Lấy nhiều ứng viên (vd. 30), chấm điểm (câu hỏi, chunk) theo từng batch trong một ngân sách
+thời gian cố định; hết giờ thì giữ nguyên thứ tự ban đầu. LLM nhận ít chunk hơn nhưng đúng hơn.
+"""
+import time
+from sentence_transformers import CrossEncoder
+
+DEFAULT_MODEL = "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1" # ~120M tham số, có tiếng Việt
+
+class Reranker:
+    def __init__(self, model_name=DEFAULT_MODEL, device="cpu", batch_size=8, time_budget=1.0, max_length=512):
+        self.model = CrossEncoder(model_name, device=device, max_length=max_length)
+        self.batch_size = batch_size
+        self.time_budget = time_budget  # giây cho mỗi câu hỏi
+        self.model.predict([("warm-up", "warm-up")])  # lần chạy đầu chậm: cho nó xảy ra lúc khởi động
+
+    def rerank(self, query, docs, top_n):
+        """Top `top_n` docs theo điểm cross-encoder; quá ngân sách thời gian => thứ tự gốc."""
+        if len(docs) <= 1:
+            return docs[:top_n]
+        started = time.monotonic()
+        scores = []
+        for start in range(0, len(docs), self.batch_size):
+            # Dừng nếu batch kế tiếp (ước theo các batch đã chạy) sẽ vượt ngân sách
+            elapsed = time.monotonic() - started
+            done = start // self.batch_size
+            if done and elapsed + elapsed / done > self.time_budget:
+                print(f"⏱️ Rerank vượt ngân sách {self.time_budget}s sau {len(scores)}/{len(docs)} chunk -> giữ thứ tự gốc")
+                return docs[:top_n]
+            batch = docs[start:start + self.batch_size]
+            scores.extend(self.model.predict([(query, d.page_content) for d in batch]))
+        ranked = sorted(range(len(docs)), key=lambda i: scores[i], reverse=True)
+        print(f"🔀 Rerank {len(docs)} chunk trong {time.monotonic() - started:.2f}s")
+        return [docs[i] for i in ranked[:top_n]]
@@ -0,0 +1,173 @@
+"""
+Tách file kinh (.md trong data/Truong_Bo_Kinh_Final) thành chunk trong một lượt đọc:
+    - header #/##/### ở đầu file -> Ten_bo_kinh / Ten_pham / Ten_bai_kinh
+      (dòng "#" xuất hiện sau khi nội dung đã bắt đầu là câu kệ bị format nhầm, coi như nội dung)
+    - mỗi khối cách nhau bởi dòng trống = một cặp [Pali] / [Việt] -> đơn vị không bị cắt đôi
+    - gom liên tiếp các khối vào chunk tới giới hạn token (đếm batch một lần cho cả file);
+      chỉ khối nào tự nó đã vượt giới hạn mới đi qua TokenChunker.split
+Chế độ song ngữ (split_bilingual): mỗi dòng Pali và dòng Việt của một khối là một chunk riêng
+(ngắn hơn, embed rẻ hơn), nối với nhau bằng metadata pair_id (xem bilingual_index.py).
+Nhiều file chạy song song trên ProcessPoolExecutor, mỗi tiến trình load tokenizer một lần.
+Tiến trình con được tạo bằng "spawn", không fork: lúc đó tiến trình cha đã load torch + model embedding
+(nhiều thread OpenMP/tokenizer), fork một tiến trình như vậy có thể treo.
+"""
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from token_chunker import TokenChunker
+from quote_index import PALI_CHARS
+
+HEADER_FIELDS = {1: "Ten_bo_kinh", 2: "Ten_pham", 3: "Ten_bai_kinh"}
+PAIR_LANGS = ("pali", "vi") # Thứ tự dòng trong một khối [Pali]\n[Việt]
+PLACEHOLDERS = {"", "x"} # Dòng "[]" (tiêu đề chưa dịch) / "[x]" (cuối kinh): không có nội dung để embed
+
+def is_placeholder(line):
+    return line.strip("[] \t").lower() in PLACEHOLDERS
+
+def segment_language(line):
+    """Ngôn ngữ của một dòng: có chữ Pali (ā, ṃ, ṭ...) => "pali", ngược lại "vi"
+    (bản Việt viết tên riêng kiểu Mahàvana, không dùng các chữ này)."""
+    return "pali" if PALI_CHARS & set(line.lower()) else "vi"
+
+def parse_scripture(text):
+    """(headers {cấp: tiêu đề}, [khối văn bản]) của một file kinh."""
+    headers, blocks, lines = {}, [], []
+    in_body = False
+    for line in text.split("\n"):
+        line = line.strip()
+        if not line:
+            if lines:
+                blocks.append("\n".join(lines))
+                lines = []
+            continue
+        if line.startswith("#"):
+            level = len(line) - len(line.lstrip("#"))
+            title = line[level:].strip()
+            if not in_body and level in HEADER_FIELDS:
+                headers = {k: v for k, v in headers.items() if k < level}
+                headers[level] = title
+                continue
+            line = title  # "#### Tụng phẩm I" hoặc câu kệ bắt đầu bằng "#": giữ chữ, bỏ dấu #
+            if not line:
+                continue
+        elif line.startswith("Source:"):
+            continue
+        in_body = True
+        lines.append(line)
+    if lines:
+        blocks.append("\n".join(lines))
+    return headers, blocks
+
+class ScriptureSplitter:
+    def __init__(self, chunker, header_format="Kinh: {ten_bai_kinh} ({ten_bo_kinh})."):
+        self.chunker = chunker  # TokenChunker (hoặc object cùng giao diện count_many/split/max_tokens)
+        self.header_format = header_format
+
+    def _file_context(self, headers, file_name):
+        """(metadata chung của file, dòng header ngữ cảnh)."""
+        metadata = {field: headers.get(level, "") for level, field in HEADER_FIELDS.items()}
+        metadata["Ten_bo_kinh"] = metadata["Ten_bo_kinh"] or "Unknown"
+        metadata["search_key"] = f"{metadata['Ten_bo_kinh']} {metadata['Ten_bai_kinh']}"
+        metadata["source_file"] = file_name
+        header = self.header_format.format(ten_bai_kinh=metadata["Ten_bai_kinh"], ten_bo_kinh=metadata["Ten_bo_kinh"])
+        return metadata, header
+
+    def split(self, text, file_name=""):
+        """[(nội dung chunk, metadata, số token)] của một file, theo đúng thứ tự trong file."""
+        headers, blocks = parse_scripture(text)
+        metadata, header = self._file_context(headers, file_name)
+        prefix = f"{header}\n"
+        max_tokens = self.chunker.max_tokens
+        budget = max_tokens - self.chunker.count_many([prefix])[0]
+        overlap = self.chunker.overlap_tokens
+
+        bodies = []
+        current, current_tokens = [], 0
+        for block, n in zip(blocks, self.chunker.count_many(blocks, special_tokens=False)):
+            if n > budget:
+                # Khối dài hơn cả một chunk: tách riêng theo câu/từ, không gộp với khối khác
+                if current:
+                    bodies.append("\n\n".join(b for b, _ in current))
+                current, current_tokens = [], 0
+                bodies.extend(chunk[len(prefix):] for chunk in self.chunker.split(block, header))
+                continue
+            if current and current_tokens + n > budget:
+                bodies.append("\n\n".join(b for b, _ in current))
+                # Overlap theo nguyên khối: giữ các khối cuối nếu tổng <= overlap và còn chỗ cho khối mới
+                kept, kept_tokens = [], 0
+                for b, m in reversed(current):
+                    if kept_tokens + m > overlap or kept_tokens + m + n > budget:
+                        break
+                    kept.insert(0, (b, m))
+                    kept_tokens += m
+                current, current_tokens = kept, kept_tokens
+            current.append((block, n))
+            current_tokens += n
+        if current:
+            bodies.append("\n\n".join(b for b, _ in current))
+
+        # Tổng token của từng khối gần bằng token của chuỗi đã nối => kiểm tra lại chính xác một lượt
+        chunks = []
+        contents = [prefix + body for body in bodies]
+        for content, body, n in zip(contents, bodies, self.chunker.count_many(contents)):
+            if n <= max_tokens:
+                chunks.append((content, dict(metadata), n))
+            else:
+                for piece in self.chunker.split(body, header):
+                    chunks.append((piece, dict(metadata), self.chunker.count_many([piece])[0]))
+        return chunks
+
+    def split_bilingual(self, text, file_name=""):
+        """Như split() nhưng mỗi dòng Pali / Việt là một chunk riêng, metadata thêm
+        lang ("pali"/"vi"), pair_id (chung cho cả khối) và segment_part (thứ tự phần, nếu dòng quá dài).
+        Dòng rỗng kiểu "[]" bị bỏ: chỉ còn header => vector gần trùng nhau, lấn át đoạn kinh thật."""
+        headers, blocks = parse_scripture(text)
+        metadata, header = self._file_context(headers, file_name)
+        prefix = f"{header}\n"
+        stem = os.path.splitext(file_name)[0]
+        segments = []
+        for index, block in enumerate(blocks):
+            lines = block.split("\n")
+            langs = PAIR_LANGS if len(lines) == len(PAIR_LANGS) else [segment_language(line) for line in lines]
+            segments.extend((line, lang, f"{stem}#{index}") for line, lang in zip(lines, langs)
+                            if not is_placeholder(line))
+
+        chunks = []
+        contents = [prefix + line for line, _, _ in segments]
+        for content, (line, lang, pair_id), n in zip(contents, segments, self.chunker.count_many(contents)):
+            segment_metadata = dict(metadata, lang=lang, pair_id=pair_id)
+            pieces = [content] if n <= self.chunker.max_tokens else self.chunker.split(line, header)
+            for part, piece in enumerate(pieces):
+                count = n if len(pieces) == 1 else self.chunker.count_many([piece])[0]
+                chunks.append((piece, dict(segment_metadata, segment_part=part), count))
+        return chunks
+
+_worker_splitter = None
+_worker_bilingual = False
+
+def _init_worker(model_name, max_tokens, overlap_tokens, header_format, bilingual):
+    global _worker_splitter, _worker_bilingual
+    _worker_splitter = ScriptureSplitter(TokenChunker(model_name, max_tokens, overlap_tokens), header_format)
+    _worker_bilingual = bilingual
+
+def _split_path(path):
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    split = _worker_splitter.split_bilingual if _worker_bilingual else _worker_splitter.split
+    return os.path.basename(path), split(text, os.path.basename(path))
+
+def split_files(paths, model_name, max_tokens=512, overlap_tokens=64,
+                header_format="Kinh: {ten_bai_kinh} ({ten_bo_kinh}).", workers=None, bilingual=False):
+    """Sinh (tên file, [(nội dung, metadata, số token)]) theo thứ tự `paths`.
+    `workers`: số tiến trình (mặc định = số CPU); 1 file hoặc workers=1 => chạy ngay trong tiến trình này.
+    `bilingual`: tách riêng dòng Pali / Việt (split_bilingual)."""
+    paths = list(paths)
+    workers = min(workers or os.cpu_count() or 1, len(paths))
+    init_args = (model_name, max_tokens, overlap_tokens, header_format, bilingual)
+    if workers <= 1:
+        _init_worker(*init_args)
+        yield from map(_split_path, paths)
+        return
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_init_worker, initargs=init_args) as executor:
+        yield from executor.map(_split_path, paths)
@@ -0,0 +1,52 @@
+"""
+Tài nguyên nặng dùng chung cho cả tiến trình Chainlit (mọi session/người dùng):
+model embedding (vài GB RAM, load ~10-30s), cross-encoder rerank và client Chroma.
+Mỗi bộ tham số chỉ được load đúng một lần; các session sau lấy lại cùng object.
+"""
+import threading
+from langchain_chroma import Chroma
+from embedding_backend import load_embeddings, cache_model_name
+from src.shared.embedding_cache import CachedEmbeddings
+from reranker import Reranker
+
+_lock = threading.Lock()
+_embeddings = {}
+_vectorstores = {}
+_rerankers = {}
+
+WARMUP_TEXT = "Instruct: Given a web search query, retrieve relevant passages that answer the query\nQuery: Kinh Phạm Võng"
+
+def get_embeddings(model_name, device=None, cache_path=None, backend="torch"):
+    """Model embedding dùng chung (đã warm-up). `device=None`: GPU nếu có, không thì CPU;
+    `backend`: xem embedding_backend.py; mặc định torch fp32, khớp vector đã lưu lúc ingest. `cache_path`: bọc thêm cache SQLite trên đĩa."""
+    key = (model_name, device, cache_path, backend)
+    with _lock:
+        if key not in _embeddings:
+            print(f"⏳ Loading embedding model {model_name}...")
+            embeddings, backend_used, _ = load_embeddings(model_name, backend, device)
+            # Encode thử một lần: lần encode đầu tiên (cấp phát bộ nhớ, khởi tạo kernel) rất chậm,
+            # để nó xảy ra lúc khởi động server thay vì ở câu hỏi đầu tiên của người dùng
+            embeddings.embed_query(WARMUP_TEXT)
+            if cache_path:
+                embeddings = CachedEmbeddings(embeddings, cache_model_name(model_name, backend_used), cache_path)
+            _embeddings[key] = embeddings
+            print(f"✅ Embedding model ready.")
+        return _embeddings[key]
+
+def get_reranker(model_name, device="cpu", time_budget=1.0):
+    """Cross-encoder dùng chung (đã warm-up trong Reranker.__init__)."""
+    key = (model_name, device, time_budget)
+    with _lock:
+        if key not in _rerankers:
+            print(f"⏳ Loading reranker {model_name} ({device})...")
+            _rerankers[key] = Reranker(model_name, device=device, time_budget=time_budget)
+            print(f"✅ Reranker ready.")
+        return _rerankers[key]
+
+def get_vectorstore(db_path, embeddings):
+    """Client Chroma dùng chung cho một thư mục DB (Chroma an toàn khi nhiều thread cùng đọc)."""
+    key = (db_path, id(embeddings))
+    with _lock:
+        if key not in _vectorstores:
+            _vectorstores[key] = Chroma(persist_directory=db_path, embedding_function=embeddings)
+        return _vectorstores[key]
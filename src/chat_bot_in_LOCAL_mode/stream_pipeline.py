@@ -0,0 +1,68 @@
+"""
+Tiện ích cho pipeline vector hóa dạng stream: đọc -> tách -> embed -> upsert theo từng batch.
+Bộ nhớ chỉ giữ vài batch cùng lúc (không gom toàn bộ chunk vào một list), và việc tách
+batch tiếp theo chạy song song với việc embed batch hiện tại.
+"""
+import queue
+import threading
+import uuid
+
+_DONE = object()
+
+class _ProducerError:
+    def __init__(self, error):
+        self.error = error
+
+def batched(iterable, size):
+    """Gom phần tử của `iterable` thành các list dài tối đa `size`."""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def prefetch(iterable, depth=2):
+    """
+    Chạy `iterable` trong một thread nền và trả lại từng phần tử.
+    Hàng đợi chỉ chứa tối đa `depth` phần tử: producer phải chờ khi consumer (GPU/CPU embed)
+    chưa xử lý kịp => backpressure, bộ nhớ không tăng.
+    """
+    q = queue.Queue(maxsize=depth)
+
+    def producer():
+        try:
+            for item in iterable:
+                q.put(item)
+        except BaseException as e:
+            q.put(_ProducerError(e))
+        finally:
+            q.put(_DONE)
+
+    threading.Thread(target=producer, daemon=True).start()
+    while True:
+        item = q.get()
+        if item is _DONE:
+            return
+        if isinstance(item, _ProducerError):
+            raise item.error
+        yield item
+
+def embed_and_upsert(db, embedding_model, batches):
+    """Embed từng batch rồi upsert thẳng vào collection Chroma. Trả về số chunk đã ghi.
+    ID lấy từ metadata["chunk_id"] nếu có (chạy lại không nhân bản), nếu không thì sinh UUID."""
+    total = 0
+    for batch in batches:
+        texts = [doc.page_content for doc in batch]
+        vectors = embedding_model.embed_documents(texts)
+        db._collection.upsert(
+            ids=[doc.metadata.get("chunk_id") or str(uuid.uuid4()) for doc in batch],
+            embeddings=vectors,
+            documents=texts,
+            metadatas=[doc.metadata for doc in batch]
+        )
+        total += len(batch)
+        print(f"  ✅ Upserted {total} chunks...")
+    return total
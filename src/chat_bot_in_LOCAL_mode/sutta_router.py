@@ -0,0 +1,136 @@
+"""
+Router tra từ vựng (không gọi LLM): tìm tên kinh được nhắc tới trong câu hỏi.
+Bảng alias được dựng một lần từ list.md: tên Pali (có/không "sutta"), tên Việt (có/không "Kinh"),
+tên trong ngoặc, bản bỏ dấu (Phạm Võng -> pham vong, Brahmajāla -> brahmajala) và số thứ tự
+(DN 14, "kinh số 14"). Tra một câu hỏi chỉ là vài phép tra dict => vài micro giây.
+"""
+import re
+from src.shared.lexical_index import fold
+
+# Thứ tự các phẩm của Trường Bộ: số kinh DN = số kinh trong phẩm + số kinh của các phẩm trước
+VAGGA_ORDER = ["silakkhandhavaggapali", "mahavaggapali", "pathikavaggapali"]
+
+# Tên Việt trùng với từ thông dụng: chỉ nhận khi có chữ "kinh" đứng trước
+GENERIC_NAMES = {"thanh tinh", "dai hoi", "tuong"}
+
+_ORDINAL_PATTERN = re.compile(r"\b(?:dn|bai kinh(?: so| thu)?|kinh(?: so| thu)?|bai(?: so| thu))\s*(\d{1,2})\b")
+
+def _pali_stem(folded):
+    """'brahmajalasuttam' -> 'brahmajala'."""
+    return re.sub(r"\s*sutt(?:am|a)$", "", folded)
+
+class Sutta:
+    def __init__(self, key, line, file_name, vagga, number_in_vagga):
+        self.key = key                  # Header 3 = giá trị metadata Ten_bai_kinh trong DB
+        self.line = line                # Dòng gốc trong list.md (gửi cho LLM khi cần)
+        self.file_name = file_name
+        self.vagga = vagga
+        self.number_in_vagga = number_in_vagga
+        self.number = None              # Số kinh DN (1..34), tính sau khi đọc hết list
+
+    def __repr__(self):
+        return f"Sutta({self.key!r}, DN {self.number})"
+
+class SuttaRouter:
+    def __init__(self, list_path):
+        self.suttas = self._load(list_path)
+        self._assign_numbers()
+        self.aliases = {}               # tuple token -> set(Sutta)
+        for sutta in self.suttas:
+            for alias in self._aliases_for(sutta):
+                self.aliases.setdefault(tuple(alias.split()), set()).add(sutta)
+        self.max_alias_len = max((len(a) for a in self.aliases), default=0)
+        self.by_number = {s.number: s for s in self.suttas if s.number}
+
+    @staticmethod
+    def _load(list_path):
+        suttas = []
+        with open(list_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                parts = [p.strip() for p in line.split("|")]
+                if len(parts) < 4:
+                    continue
+                # "2. 1. Brahmajālasuttaṃ - 1. Kinh Phạm Võng.md" -> bỏ số dòng, lấy số trong phẩm
+                file_name = re.sub(r"^\d+\.\s*", "", parts[0])
+                match = re.match(r"(\d+)", file_name)
+                suttas.append(Sutta(parts[-1], line, file_name, fold(parts[2]), int(match.group(1)) if match else None))
+        return suttas
+
+    def _assign_numbers(self):
+        offset = 0
+        for vagga in VAGGA_ORDER:
+            members = [s for s in self.suttas if vagga in s.vagga.replace(" ", "")]
+            for sutta in members:
+                if sutta.number_in_vagga:
+                    sutta.number = offset + sutta.number_in_vagga
+            offset += len(members)
+
+    @staticmethod
+    def _names(sutta):
+        """Mọi tên xuất hiện trong tên file và Header 3, kể cả phần trong ngoặc."""
+        base = re.sub(r"\.md$", "", sutta.file_name)
+        names = []
+        for part in base.split(" - ") + [sutta.key]:
+            part = re.sub(r"^\d+\.?\s*", "", part.strip())
+            names.extend(n.strip() for n in re.findall(r"[^()]+", part) if n.strip())
+        return names
+
+    def _aliases_for(self, sutta):
+        folded_names = [fold(n) for n in self._names(sutta)]
+        pali_stems = [_pali_stem(n) for n in folded_names if re.search(r"sutt(?:am|a)$", n)]
+        aliases = set()
+        for stem in pali_stems:
+            aliases.update({stem, f"{stem} sutta", f"{stem}sutta", f"{stem} suttam", f"{stem}suttam"})
+        for name in folded_names:
+            if name in aliases or re.search(r"sutt(?:am|a)$", name):
+                continue
+            bare = name[5:] if name.startswith("kinh ") else name
+            if not bare:
+                continue
+            aliases.add(f"kinh {bare}")
+            tokens = bare.split()
+            if bare in GENERIC_NAMES:
+                continue
+            # Một từ: chỉ nhận bản không có "kinh" nếu là tên riêng phiên âm Pali (Subha, Mahāli, ...)
+            if len(tokens) >= 2 or any(stem.startswith(bare[:4]) for stem in pali_stems):
+                aliases.add(bare)
+        return aliases
+
+    def match(self, query):
+        """Các kinh được nhắc tới trong câu hỏi (alias dài nhất thắng, theo thứ tự xuất hiện)."""
+        folded = fold(query)
+        found = []
+
+        for number in _ORDINAL_PATTERN.findall(folded):
+            sutta = self.by_number.get(int(number))
+            if sutta and sutta not in found:
+                found.append(sutta)
+
+        tokens = folded.split()
+        i = 0
+        while i < len(tokens):
+            for n in range(min(self.max_alias_len, len(tokens) - i), 0, -1):
+                suttas = self.aliases.get(tuple(tokens[i:i + n]))
+                if suttas:
+                    found.extend(s for s in sorted(suttas, key=lambda s: s.number or 0) if s not in found)
+                    i += n
+                    break
+            else:
+                i += 1
+        return found
+
+    def route(self, query, resolve=None):
+        """
+        Trả về key metadata (Header 3) của kinh được hỏi, hoặc None (tìm trên toàn bộ).
+        Chỉ khi khớp nhiều kinh mới gọi `resolve(query, candidates)` (vd. hỏi LLM
+        với đúng các dòng ứng viên) để chọn; resolve trả về key hoặc None.
+        """
+        candidates = self.match(query)
+        if len(candidates) == 1:
+            return candidates[0].key
+        if len(candidates) > 1 and resolve:
+            return resolve(query, candidates)
+        return None
@@ -0,0 +1,108 @@
+"""
+Tách chunk theo số token của chính tokenizer model embedding (không theo số ký tự).
+Pali/Việt nhiều dấu => 1200 ký tự có thể vượt 512 token của E5, phần thừa bị cắt âm thầm khi embed.
+TokenChunker đảm bảo mọi chunk, kể cả dòng header ngữ cảnh thêm vào đầu, <= max_tokens
+(tính cả token đặc biệt <s> </s>).
+
+bucketed(): gom các chunk có độ dài gần nhau vào cùng batch (sắp xếp trong một cửa sổ trượt)
+và giới hạn tổng token sau padding của mỗi batch => chunk ngắn không bị pad tới độ dài chunk dài.
+"""
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from transformers import AutoTokenizer
+
+SEPARATORS = ["\n\n", "\n", "(?<=\\. )", " ", ""] # Ưu tiên ngắt đoạn, rồi dòng, rồi câu
+
+class TokenChunker:
+    def __init__(self, model_name, max_tokens=512, overlap_tokens=64):
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        # Số token đặc biệt tokenizer thêm vào mỗi chuỗi (E5/XLM-R: <s> ... </s> = 2)
+        self.special_tokens = len(self.tokenizer("")["input_ids"])
+        self._splitters = {}  # budget -> splitter: tạo một lần, không tạo lại cho mỗi section
+
+    def count(self, text):
+        """Số token model thực sự nhận (có token đặc biệt)."""
+        return len(self.tokenizer(text, verbose=False)["input_ids"])
+
+    def count_many(self, texts, special_tokens=True):
+        """count() cho cả list trong một lần gọi tokenizer (batch, nhanh hơn nhiều)."""
+        if not texts:
+            return []
+        encoded = self.tokenizer(list(texts), add_special_tokens=special_tokens, verbose=False)["input_ids"]
+        return [len(ids) for ids in encoded]
+
+    def _splitter(self, budget):
+        if budget not in self._splitters:
+            self._splitters[budget] = self._make_splitter(budget)
+        return self._splitters[budget]
+
+    def _make_splitter(self, budget):
+        return RecursiveCharacterTextSplitter(
+            chunk_size=budget,
+            chunk_overlap=min(self.overlap_tokens, budget // 4),
+            separators=SEPARATORS,
+            is_separator_regex=True,
+            keep_separator=True,
+            length_function=lambda text: len(self.tokenizer(text, add_special_tokens=False, verbose=False)["input_ids"]),
+        )
+
+    def _hard_split(self, text, budget):
+        """Cắt theo đúng ranh giới token (offset ký tự) khi không còn separator nào dùng được."""
+        encoding = self.tokenizer(text, add_special_tokens=False, return_offsets_mapping=True, verbose=False)
+        offsets = encoding["offset_mapping"]
+        pieces = []
+        for start in range(0, len(offsets), budget):
+            window = offsets[start:start + budget]
+            pieces.append(text[window[0][0]:window[-1][1]])
+        return pieces
+
+    def _fit(self, prefix, piece, budget):
+        """Tokenize không cộng tính tuyệt đối ở chỗ nối => kiểm tra lại cả chuỗi cuối cùng,
+        vượt thì cắt cứng theo token và giảm dần budget tới khi mọi phần đều vừa."""
+        parts = [piece]
+        while any(self.count(prefix + part) > self.max_tokens for part in parts):
+            budget -= 8
+            if budget <= 0:
+                raise ValueError(f"Không tách được đoạn văn xuống {self.max_tokens} token")
+            parts = self._hard_split(piece, budget)
+        return [prefix + part for part in parts]
+
+    def split(self, text, header=""):
+        """Các đoạn `header\nđoạn` (hoặc chỉ `đoạn` nếu không có header), mỗi đoạn <= max_tokens."""
+        prefix = f"{header}\n" if header else ""
+        # count() đã gồm token đặc biệt; phần còn lại dành cho nội dung
+        budget = self.max_tokens - (self.count(prefix) if prefix else self.special_tokens)
+        if budget <= 0:
+            raise ValueError(f"Header dài hơn {self.max_tokens} token: {header[:80]!r}")
+        chunks = []
+        for piece in self._splitter(budget).split_text(text):
+            chunks.extend(self._fit(prefix, piece, budget))
+        return chunks
+
+def bucketed(docs, max_batch_tokens=16384, max_batch_size=64, window=1024, length=None):
+    """Chia `docs` thành batch theo độ dài token (metadata["token_count"] hoặc `length(doc)`):
+    sắp xếp từng cửa sổ `window` chunk theo độ dài, rồi cắt batch sao cho
+    len(batch) * chunk dài nhất <= max_batch_tokens (= số token sau padding)."""
+    length = length or (lambda doc: doc.metadata["token_count"])
+
+    def flush(buffer):
+        batch, longest = [], 0
+        for doc in sorted(buffer, key=length):
+            n = length(doc)
+            if batch and (len(batch) >= max_batch_size or (len(batch) + 1) * max(longest, n) > max_batch_tokens):
+                yield batch
+                batch, longest = [], 0
+            batch.append(doc)
+            longest = max(longest, n)
+        if batch:
+            yield batch
+
+    buffer = []
+    for doc in docs:
+        buffer.append(doc)
+        if len(buffer) >= window:
+            yield from flush(buffer)
+            buffer = []
+    if buffer:
+        yield from flush(buffer)
@@ -0,0 +1,115 @@
+"""
+Cache embedding trên đĩa (SQLite), dùng chung cho lúc ingest và lúc query.
+Khóa = sha256(model | instruction | loại (document/query) | text đã chuẩn hóa), nên một đoạn
+văn chỉ tốn GPU/CPU/quota đúng một lần, dù chạy lại ingest hay người dùng hỏi lại.
+Giới hạn số vector lưu; vượt quá thì xóa các vector lâu nhất không được dùng (LRU).
+"""
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from langchain_core.embeddings import Embeddings
+
+DEFAULT_MAX_ENTRIES = 200_000  # 200k x 1024 chiều x 4 byte (float32) ≈ 0.82 GB; 768 chiều ≈ 0.61 GB (chưa tính key/index SQLite)
+_SQLITE_MAX_VARS = 900          # giới hạn số tham số "?" trong một câu lệnh SQLite
+
+def normalize_text(text):
+    """NFC + gộp khoảng trắng: cùng nội dung nhưng khác cách gõ dấu/xuống dòng => cùng khóa."""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip()
+
+class CachedEmbeddings(Embeddings):
+    """
+    Bọc một Embeddings bất kỳ (HuggingFaceEmbeddings, GoogleGenerativeAIEmbeddings, ...).
+    Chỉ những text chưa từng thấy mới được gửi tới model bên trong.
+    """
+    def __init__(self, embeddings, model_name, path, instruction="", max_entries=DEFAULT_MAX_ENTRIES):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.instruction = instruction  # vd. task_type hoặc prompt của model: khác instruction => khác vector
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()  # connection sqlite3 không dùng chung giữa các thread
+        conn = self._connect()
+        conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB, last_used REAL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _key(self, text, kind):
+        raw = f"{self.model_name}\0{self.instruction}\0{kind}\0{normalize_text(text)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _lookup(self, keys):
+        """{key: vector} của các khóa đã có trong cache (và đánh dấu vừa dùng)."""
+        conn = self._connect()
+        found = {}
+        unique = list(dict.fromkeys(keys))
+        for start in range(0, len(unique), _SQLITE_MAX_VARS):
+            part = unique[start:start + _SQLITE_MAX_VARS]
+            rows = conn.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(part))})", part
+            ).fetchall()
+            for key, blob in rows:
+                found[key] = array("f", blob).tolist()
+        if found:
+            now = time.time()
+            conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, k) for k in found])
+        return found
+
+    def _store(self, items):
+        """Lưu [(key, vector)] rồi xóa bớt các vector ít dùng nhất nếu vượt max_entries."""
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)",
+                [(key, array("f", vector).tobytes(), now) for key, vector in items]
+            )
+            excess = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0] - self.max_entries
+            if excess > 0:
+                conn.execute(
+                    "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (excess,)
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def missing(self, texts, kind="document"):
+        """Các text (không trùng lặp) chưa có trong cache, vd. để chỉ tính quota cho chúng."""
+        keys = {self._key(t, kind): t for t in texts}
+        found = self._lookup(list(keys))
+        return [t for k, t in keys.items() if k not in found]
+
+    def embed_documents(self, texts):
+        keys = [self._key(t, "document") for t in texts]
+        vectors = self._lookup(keys)
+
+        # Chỉ embed text chưa thấy (mỗi text một lần, kể cả khi lặp lại trong cùng batch)
+        todo = {k: t for k, t in zip(keys, texts) if k not in vectors}
+        if todo:
+            new_vectors = self.embeddings.embed_documents(list(todo.values()))
+            new_items = list(zip(todo, new_vectors))
+            self._store(new_items)
+            vectors.update(new_items)
+        return [list(vectors[k]) for k in keys]
+
+    def embed_query(self, text):
+        key = self._key(text, "query")
+        cached = self._lookup([key])
+        if key in cached:
+            return cached[key]
+        vector = self.embeddings.embed_query(text)
+        self._store([(key, vector)])
+        return list(vector)
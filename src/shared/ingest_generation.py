@@ -0,0 +1,25 @@
+"""
+Bộ đếm "thế hệ" dữ liệu của một thư mục DB: mỗi lần ingest ghi thay đổi vào Chroma thì tăng 1.
+Các cache phụ thuộc vào nội dung DB (câu trả lời, kết quả tìm kiếm) lưu kèm số thế hệ
+và tự bỏ các mục cũ khi số này đổi.
+"""
+import os
+
+GENERATION_FILE = "ingest_generation"
+
+def read_generation(db_dir):
+    try:
+        with open(os.path.join(db_dir, GENERATION_FILE), "r", encoding="utf-8") as f:
+            return int(f.read().strip() or 0)
+    except (FileNotFoundError, ValueError):
+        return 0
+
+def bump_generation(db_dir):
+    """Tăng số thế hệ (ghi file tạm rồi đổi tên để tiến trình khác không đọc phải file dở)."""
+    generation = read_generation(db_dir) + 1
+    os.makedirs(db_dir, exist_ok=True)
+    path = os.path.join(db_dir, GENERATION_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        f.write(str(generation))
+    os.replace(path + ".tmp", path)
+    return generation
@@ -0,0 +1,211 @@
+"""
+Chỉ mục từ vựng (BM25) trên đúng các chunk đã lưu trong Chroma + retriever lai BM25/vector (RRF).
+
+Tách từ hiểu dấu: mỗi từ được index ở dạng gốc (chữ thường, NFC: "sāmaññaphala", "niệm")
+và dạng bỏ dấu ("~samannaphala", "~niem"). Gõ đúng dấu => khớp cả hai => điểm cao hơn;
+gõ không dấu vẫn tìm được.
+
+Lưu trên đĩa (thư mục `path`):
+    terms.json      {term: [offset, df]}
+    postings.bin    doc id (uint32) của từng term, xếp liền nhau
+    tfs.bin         tần suất tương ứng (uint16)
+    docs.json       chunk id trong Chroma + độ dài từng chunk
+postings/tfs được mmap nên chỉ những term có trong câu hỏi mới được đọc từ đĩa.
+"""
+import heapq
+import json
+import math
+import mmap
+import os
+import re
+import sys
+import unicodedata
+from array import array
+from collections import Counter
+from typing import Any, List, Optional
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+FOLD_PREFIX = "~"
+
+def fold(text):
+    """Chữ thường, bỏ dấu (cả dấu Pali), đ -> d, ký tự khác chữ/số -> khoảng trắng."""
+    text = unicodedata.normalize("NFD", text.lower().replace("đ", "d"))
+    text = "".join(c for c in text if unicodedata.category(c) != "Mn")
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", text).split())
+
+def tokenize(text, query=False):
+    """Từ ở dạng gốc + dạng bỏ dấu (chỉ thêm khi khác dạng gốc).
+    query=True: từ không dấu cũng tra dạng bỏ dấu, để "samannaphala" tìm được "sāmaññaphala"."""
+    terms = []
+    for word in re.findall(r"\w+", unicodedata.normalize("NFC", text.lower())):
+        terms.append(word)
+        folded = fold(word).replace(" ", "")
+        if folded and (folded != word or query):
+            terms.append(FOLD_PREFIX + folded)
+    return terms
+
+def _write_atomic(path, data):
+    with open(path + ".tmp", "wb") as f:
+        f.write(data)
+    os.replace(path + ".tmp", path)
+
+class LexicalIndex:
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "terms.json"), "r", encoding="utf-8") as f:
+            self.terms = json.load(f)
+        with open(os.path.join(path, "docs.json"), "r", encoding="utf-8") as f:
+            docs = json.load(f)
+        self.ids = docs["ids"]
+        self.lengths = docs["lengths"]
+        self.avgdl = (sum(self.lengths) / len(self.lengths)) if self.lengths else 1.0
+        self.postings = self._map("postings.bin", "I")
+        self.tfs = self._map("tfs.bin", "H")
+
+    def _map(self, name, typecode):
+        with open(os.path.join(self.path, name), "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return memoryview(b"").cast(typecode)
+            return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)).cast(typecode)
+
+    @staticmethod
+    def exists(path):
+        return os.path.exists(os.path.join(path, "docs.json"))
+
+    @staticmethod
+    def build(items, path):
+        """Dựng index từ (chunk_id, text). Ghi đè index cũ (từng file ghi tạm rồi đổi tên)."""
+        postings = {}
+        ids, lengths = [], []
+        for doc_idx, (chunk_id, text) in enumerate(items):
+            terms = tokenize(text)
+            ids.append(chunk_id)
+            lengths.append(len(terms))
+            for term, tf in Counter(terms).items():
+                postings.setdefault(term, []).append((doc_idx, min(tf, 65535)))
+
+        doc_array, tf_array, vocab = array("I"), array("H"), {}
+        for term in sorted(postings):
+            vocab[term] = [len(doc_array), len(postings[term])]
+            for doc_idx, tf in postings[term]:
+                doc_array.append(doc_idx)
+                tf_array.append(tf)
+
+        os.makedirs(path, exist_ok=True)
+        _write_atomic(os.path.join(path, "postings.bin"), doc_array.tobytes())
+        _write_atomic(os.path.join(path, "tfs.bin"), tf_array.tobytes())
+        _write_atomic(os.path.join(path, "terms.json"), json.dumps(vocab, ensure_ascii=False).encode("utf-8"))
+        _write_atomic(os.path.join(path, "docs.json"), json.dumps({"ids": ids, "lengths": lengths}).encode("utf-8"))
+        print(f"✅ Lexical index: {len(ids)} chunks, {len(vocab)} terms -> {path}")
+        return LexicalIndex(path)
+
+    @staticmethod
+    def build_from_chroma(db, path, page_size=1000):
+        """Dựng index trên toàn bộ chunk của một langchain Chroma (đọc theo trang)."""
+        def items():
+            offset = 0
+            while True:
+                page = db._collection.get(include=["documents"], limit=page_size, offset=offset)
+                if not page["ids"]:
+                    return
+                yield from zip(page["ids"], page["documents"])
+                offset += len(page["ids"])
+        return LexicalIndex.build(items(), path)
+
+    def search(self, query, k=20):
+        """[(chunk_id, điểm BM25)] của k chunk tốt nhất."""
+        n_docs = len(self.ids)
+        scores = {}
+        for term, qtf in Counter(tokenize(query, query=True)).items():
+            entry = self.terms.get(term)
+            if not entry:
+                continue
+            offset, df = entry
+            idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            for i in range(offset, offset + df):
+                doc_idx, tf = self.postings[i], self.tfs[i]
+                norm = self.K1 * (1 - self.B + self.B * self.lengths[doc_idx] / self.avgdl)
+                scores[doc_idx] = scores.get(doc_idx, 0.0) + qtf * idf * tf * (self.K1 + 1) / (tf + norm)
+        best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(self.ids[doc_idx], score) for doc_idx, score in best]
+
+def matches_filter(metadata, where):
+    """Kiểm tra metadata với filter kiểu Chroma (so sánh bằng, $and, $or, $eq, $in)."""
+    if not where:
+        return True
+    for key, cond in where.items():
+        if key == "$or":
+            if not any(matches_filter(metadata, c) for c in cond):
+                return False
+        elif key == "$and":
+            if not all(matches_filter(metadata, c) for c in cond):
+                return False
+        elif isinstance(cond, dict):
+            if "$eq" in cond and metadata.get(key) != cond["$eq"]:
+                return False
+            if "$in" in cond and metadata.get(key) not in cond["$in"]:
+                return False
+        elif metadata.get(key) != cond:
+            return False
+    return True
+
+class HybridRetriever(BaseRetriever):
+    """
+    Kết hợp kết quả vector (Chroma) và BM25 bằng Reciprocal Rank Fusion:
+    điểm = sum(1 / (rrf_k + thứ hạng)) trên hai danh sách.
+    `query_prefix` chỉ thêm vào câu hỏi phía vector (vd. instruction của E5).
+    `cache`: RetrievalCache (tùy chọn) cho phía vector.
+    """
+    vectorstore: Any
+    index: Any
+    k: int = 5
+    fetch_k: int = 20
+    rrf_k: int = 60
+    filter: Optional[dict] = None
+    query_prefix: str = ""
+    cache: Any = None
+
+    def _get_relevant_documents(self, query, *, run_manager=None) -> List[Document]:
+        if self.cache is not None:
+            results = self.cache.search(self.vectorstore, self.query_prefix + query, self.fetch_k, self.filter)
+            vector_docs = [doc for doc, _ in results]
+        else:
+            vector_docs = self.vectorstore.similarity_search(self.query_prefix + query, k=self.fetch_k, filter=self.filter)
+        return self.fuse(vector_docs, query, filter=self.filter, k=self.k)
+
+    def fuse(self, vector_docs, query, filter=None, k=None):
+        """Trộn danh sách vector đã có (xếp theo độ tương đồng) với kết quả BM25 của `query`."""
+        k = k or self.k
+        lexical_ids = [chunk_id for chunk_id, _ in self.index.search(query, self.fetch_k)]
+
+        by_text = {doc.page_content: doc for doc in vector_docs}
+        scores = {}
+        for rank, doc in enumerate(vector_docs):
+            scores[doc.page_content] = 1 / (self.rrf_k + rank + 1)
+
+        if lexical_ids:
+            found = self.vectorstore._collection.get(ids=lexical_ids, include=["documents", "metadatas"])
+            lexical_docs = {i: Document(page_content=text, metadata=meta or {})
+                            for i, text, meta in zip(found["ids"], found["documents"], found["metadatas"])}
+            rank = 0
+            for chunk_id in lexical_ids:
+                doc = lexical_docs.get(chunk_id)
+                if doc is None or not matches_filter(doc.metadata, filter):
+                    continue
+                rank += 1
+                by_text.setdefault(doc.page_content, doc)
+                scores[doc.page_content] = scores.get(doc.page_content, 0.0) + 1 / (self.rrf_k + rank)
+
+        best = sorted(scores, key=scores.get, reverse=True)[:k]
+        return [by_text[text] for text in best]
+
+if __name__ == "__main__":
+    # python -m src.shared.lexical_index [chroma_dir] [index_dir]   (chạy từ thư mục gốc repo)
+    from langchain_chroma import Chroma
+    db_path = sys.argv[1] if len(sys.argv) > 1 else "./chroma_db3"
+    index_path = sys.argv[2] if len(sys.argv) > 2 else os.path.join(db_path, "bm25")
+    LexicalIndex.build_from_chroma(Chroma(persist_directory=db_path), index_path)
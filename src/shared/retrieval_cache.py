@@ -0,0 +1,106 @@
+"""
+Cache kết quả tìm kiếm trong tiến trình:
+    (câu hỏi đã chuẩn hóa, k, filter) -> [(chunk id, điểm)]   (LRU)
+    câu hỏi đã chuẩn hóa -> vector câu hỏi                      (LRU)
+Cùng câu hỏi + cùng filter trong thời gian ngắn => không embed lại (không tốn quota Gemini),
+không tìm lại trong Chroma; chỉ đọc lại nội dung chunk theo id.
+Cả hai tự xóa khi số thế hệ ingest của DB đổi (xem ingest_generation.py).
+"""
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, List, Optional
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from src.shared.embedding_cache import normalize_text
+from src.shared.ingest_generation import read_generation
+
+class RetrievalCache:
+    def __init__(self, db_dir, max_results=1024, max_vectors=1024):
+        self.db_dir = db_dir
+        self.max_results = max_results
+        self.max_vectors = max_vectors
+        self._results = OrderedDict()
+        self._vectors = OrderedDict()
+        self._generation = read_generation(db_dir)
+        self._lock = threading.Lock()
+
+    def _check_generation(self):
+        generation = read_generation(self.db_dir)
+        if generation != self._generation:
+            self._results.clear()
+            self._vectors.clear()
+            self._generation = generation
+
+    @staticmethod
+    def _put(store, key, value, limit):
+        store[key] = value
+        store.move_to_end(key)
+        while len(store) > limit:
+            store.popitem(last=False)
+
+    @staticmethod
+    def _result_key(query, k, filter):
+        return normalize_text(query), k, json.dumps(filter, sort_keys=True, ensure_ascii=False)
+
+    def embed(self, embeddings, query):
+        """Vector của câu hỏi, qua LRU (model khác nhau => khóa khác nhau)."""
+        key = (getattr(embeddings, "model_name", type(embeddings).__name__), normalize_text(query))
+        with self._lock:
+            self._check_generation()
+            vector = self._vectors.get(key)
+            if vector is not None:
+                self._vectors.move_to_end(key)
+                return vector
+        vector = embeddings.embed_query(query)
+        with self._lock:
+            self._put(self._vectors, key, vector, self.max_vectors)
+        return vector
+
+    def has_vector(self, embeddings, query):
+        key = (getattr(embeddings, "model_name", type(embeddings).__name__), normalize_text(query))
+        with self._lock:
+            self._check_generation()
+            return key in self._vectors
+
+    def lookup(self, vectorstore, query, k, filter=None):
+        """[(Document, điểm)] nếu đã có trong cache, ngược lại None."""
+        key = self._result_key(query, k, filter)
+        with self._lock:
+            self._check_generation()
+            hits = self._results.get(key)
+            if hits is None:
+                return None
+            self._results.move_to_end(key)
+        if not hits:
+            return []
+        ids = [chunk_id for chunk_id, _ in hits]
+        found = vectorstore._collection.get(ids=ids, include=["documents", "metadatas"])
+        docs = {i: Document(id=i, page_content=text, metadata=meta or {})
+                for i, text, meta in zip(found["ids"], found["documents"], found["metadatas"])}
+        return [(docs[i], score) for i, score in hits if i in docs]
+
+    def search(self, vectorstore, query, k, filter=None, query_vector=None):
+        """Như similarity_search_with_score nhưng qua cache. `query_vector`: vector đã có sẵn."""
+        results = self.lookup(vectorstore, query, k, filter)
+        if results is not None:
+            return results
+        if query_vector is None:
+            query_vector = self.embed(vectorstore.embeddings, query)
+        results = vectorstore.similarity_search_by_vector_with_relevance_scores(query_vector, k=k, filter=filter)
+        # Chỉ cache được khi Chroma trả về id cho từng Document
+        if all(getattr(doc, "id", None) for doc, _ in results):
+            with self._lock:
+                self._put(self._results, self._result_key(query, k, filter),
+                          [(doc.id, score) for doc, score in results], self.max_results)
+        return results
+
+class CachedRetriever(BaseRetriever):
+    """Retriever vector thường, đi qua RetrievalCache."""
+    vectorstore: Any
+    cache: Any
+    k: int = 5
+    filter: Optional[dict] = None
+
+    def _get_relevant_documents(self, query, *, run_manager=None) -> List[Document]:
+        return [doc for doc, _ in self.cache.search(self.vectorstore, query, self.k, self.filter)]